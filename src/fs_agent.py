@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# Remote test case agent. Gets uploaded once to the FreeBSD target and runs the whole
+# attach -> detect -> mount -> workload -> unmount -> detach sequence in a single invocation.
+# Only depends on the standard library, the result is printed as one json line on stdout.
+
+import argparse
+import base64
+import errno
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+STEP_TIMEOUT = 3
+MOUNT_TIMEOUT = 10
+CACHE_DIR = "/root/cache"
+PATCH_MAGIC = b"FSP1"  # keep in sync with fs_transfer.py
+PATCH_HDR = "<QI"
+PATCH_ENTRY = "<QI"
+PACK_MAGIC = b"FSZ1"
+PACK_HDR = "<BQ"
+PACK_EXTENT = "<QII"
+# sys/kcov.h
+KCOV_DEV = "/dev/kcov"
+KIOENABLE = 0x20046302
+KIODISABLE = 0x20006303
+KIOSETBUFSIZE = 0x20046304
+KCOV_MODE_TRACE_PC = 0
+KCOV_ENTRIES = 1 << 18
+MAP_BITS = 16  # keep in sync with fs_coverage.py
+MNT_FORCE = 0x80000
+
+
+def _decompress(data, codec):
+    if codec == 1:
+        return zlib.decompress(data)
+    if codec == 2:
+        import lzma  # not every python build on the targets ships it
+
+        return lzma.decompress(data)
+    return data
+
+
+def _decode_ops(encoded):
+    # see fs_workload.encode()
+    return json.loads(zlib.decompress(base64.b64decode(encoded)))
+
+
+def _do_op(op, root):
+    name, args = op[0], op[1:]
+    path = os.path.join(root, args[0])
+    if name == "create":
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o644))
+    elif name == "mkdir":
+        os.mkdir(path)
+    elif name == "write":
+        block, size, byte = args[1:]
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.lseek(fd, block * size, os.SEEK_SET)
+            os.write(fd, bytes([byte]) * size)
+        finally:
+            os.close(fd)
+    elif name == "truncate":
+        os.truncate(path, args[1])
+    elif name == "rename":
+        os.rename(path, os.path.join(root, args[1]))
+    elif name == "link":
+        os.link(path, os.path.join(root, args[1]))
+    elif name == "readdir":
+        os.listdir(path)
+    elif name == "stat":
+        os.stat(path)
+    elif name == "unlink":
+        os.unlink(path)
+    elif name == "fsync":
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    else:
+        raise OSError(errno.EINVAL, f"unknown op {name}")
+
+
+def _run_ops(ops, root, rcs):
+    # The ops run in this process, so kcov sees them. rcs is filled as we go, on a hang it tells the stuck op
+    for op in ops:
+        try:
+            _do_op(op, root)
+            rcs.append(0)
+        except OSError as e:
+            rcs.append(e.errno or -1)
+    return {"rc": 0, "out": ""}
+
+
+def _threaded(fn, timeout):
+    # Runs fn in a fresh thread, a syscall stuck in the kernel is left behind with rc None
+    res = {"rc": None, "out": "timeout"}
+
+    def run():
+        res.update(fn())
+
+    start = time.time()
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(timeout)
+    res["time"] = round(time.time() - start, 6)
+    return res
+
+
+def _run(cmd, timeout=STEP_TIMEOUT, cwd=None):
+    start = time.time()
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+        try:
+            out, _ = p.communicate(timeout=timeout)
+            rc, out = p.returncode, out.decode(errors="replace").strip()
+        except subprocess.TimeoutExpired:
+            # no wait() after the kill, a mount stuck in uninterruptible sleep would never be reaped
+            p.kill()
+            rc, out = None, "timeout"
+    except OSError as e:
+        rc, out = None, str(e)
+    return {"rc": rc, "out": out, "time": round(time.time() - start, 6)}
+
+
+def _apply_patch(patch_path, cache_dir, image):
+    # Rebuilds the test case from a cached base image plus the patch list of the mutant
+    with open(patch_path, "rb") as f:
+        patch = f.read()
+    if patch[:4] != PATCH_MAGIC:
+        return {"rc": 1, "out": "bad patch"}
+    base = os.path.join(cache_dir, patch[4:36].hex())
+    if not os.path.isfile(base):
+        return {"rc": 2, "out": "cache miss", "cache_miss": True}
+    size, n = struct.unpack_from(PATCH_HDR, patch, 36)
+    pos = 36 + struct.calcsize(PATCH_HDR)
+    shutil.copyfile(base, image)
+    with open(image, "r+b") as f:
+        f.truncate(size)
+        for _ in range(n):
+            off, ln = struct.unpack_from(PATCH_ENTRY, patch, pos)
+            pos += struct.calcsize(PATCH_ENTRY)
+            f.seek(off)
+            f.write(patch[pos : pos + ln])
+            pos += ln
+    return {"rc": 0, "out": f"{n} patches"}
+
+
+def _unpack(packed_path, image):
+    # Expands a sparse packed image, the holes are never written
+    with open(packed_path, "rb") as f:
+        packed = f.read()
+    if packed[:4] != PACK_MAGIC:
+        return {"rc": 1, "out": "bad pack"}
+    codec, size = struct.unpack_from(PACK_HDR, packed, 4)
+    pos = 4 + struct.calcsize(PACK_HDR)
+    if os.path.exists(image):
+        os.unlink(image)
+    n = 0
+    with open(image, "wb") as f:
+        f.truncate(size)
+        while pos < len(packed):
+            off, raw, comp = struct.unpack_from(PACK_EXTENT, packed, pos)
+            pos += struct.calcsize(PACK_EXTENT)
+            f.seek(off)
+            f.write(_decompress(packed[pos : pos + comp], codec))
+            pos += comp
+            n += 1
+    return {"rc": 0, "out": f"{n} extents"}
+
+
+class Kcov:
+    # Traces the kernel PCs hit by the thread between enable() and disable()
+    def __init__(self, entries=KCOV_ENTRIES):
+        import fcntl
+        import mmap
+
+        self.fcntl = fcntl
+        self.entries = entries
+        self.fd = os.open(KCOV_DEV, os.O_RDWR)
+        fcntl.ioctl(self.fd, KIOSETBUFSIZE, entries)
+        self.buf = mmap.mmap(self.fd, entries * 8, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.pcs = 0
+        self.edges = set()
+
+    def enable(self):
+        struct.pack_into("<Q", self.buf, 0, 0)
+        self.fcntl.ioctl(self.fd, KIOENABLE, KCOV_MODE_TRACE_PC)
+
+    def disable(self):
+        self.fcntl.ioctl(self.fd, KIODISABLE, 0)
+        n = min(struct.unpack_from("<Q", self.buf, 0)[0], self.entries - 1)
+        self.pcs += n
+        # AFL style edges: hash of (previous pc, pc) folded into MAP_BITS
+        mask = (1 << MAP_BITS) - 1
+        prev = 0
+        for pc in struct.unpack_from(f"<{n}Q", self.buf, 8):
+            cur = (pc ^ (pc >> MAP_BITS) ^ (pc >> 2 * MAP_BITS)) & mask
+            self.edges.add(cur ^ prev)
+            prev = cur >> 1
+
+    def traced(self, fn, timeout):
+        # kcov follows a thread, the syscall runs in a fresh one so a stuck mount can still be timed out
+        def run():
+            try:
+                self.enable()
+            except OSError as e:
+                # e.g. still enabled by a thread stuck in an earlier syscall
+                return {"rc": 1, "out": f"kcov: {e}"}
+            try:
+                return fn()
+            finally:
+                self.disable()
+
+        return _threaded(run, timeout)
+
+    def result(self):
+        edges = sorted(self.edges)
+        return {"edges": base64.b64encode(struct.pack(f"<{len(edges)}H", *edges)).decode(), "pcs": self.pcs}
+
+    def close(self):
+        self.buf.close()
+        os.close(self.fd)
+
+
+def _libc():
+    import ctypes
+    import ctypes.util
+
+    return ctypes, ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def _nmount(fstype, dev, path):
+    ctypes, libc = _libc()
+
+    class iovec(ctypes.Structure):
+        _fields_ = [("iov_base", ctypes.c_char_p), ("iov_len", ctypes.c_size_t)]
+
+    opts = [b"fstype", fstype.encode(), b"fspath", path.encode(), b"from", dev.encode()]
+    iov = (iovec * len(opts))(*[iovec(o, len(o) + 1) for o in opts])
+    if libc.nmount(iov, len(opts), 0) != 0:
+        return {"rc": ctypes.get_errno(), "out": os.strerror(ctypes.get_errno())}
+    return {"rc": 0, "out": ""}
+
+
+def _unmount(path):
+    ctypes, libc = _libc()
+    if libc.unmount(path.encode(), MNT_FORCE) != 0:
+        return {"rc": ctypes.get_errno(), "out": os.strerror(ctypes.get_errno())}
+    return {"rc": 0, "out": ""}
+
+
+class Agent:
+    def __init__(
+        self,
+        image,
+        mount_at,
+        fs_type=None,
+        workload=None,
+        ops=None,
+        step_timeout=STEP_TIMEOUT,
+        mount_timeout=MOUNT_TIMEOUT,
+        patch=None,
+        cache_dir=CACHE_DIR,
+        packed=None,
+        kcov=False,
+    ):
+        self.image = image
+        self.mount_at = mount_at
+        self.fs_type = fs_type
+        self.workload = workload or []
+        self.ops = ops or []
+        self.step_timeout = step_timeout
+        self.mount_timeout = mount_timeout
+        self.patch = patch
+        self.packed = packed
+        self.cache_dir = cache_dir
+        self.cache_miss = False
+        self.kcov_enabled = kcov
+        self.kcov = None
+        self.dev = None
+        self.steps = []
+
+    def _step(self, name, res):
+        res["name"] = name
+        res["ok"] = res["rc"] == 0
+        self.steps.append(res)
+        return res["ok"]
+
+    def _stage(self):
+        if not self.patch and not self.packed:
+            return True
+        start = time.time()
+        try:
+            if self.patch:
+                res = _apply_patch(self.patch, self.cache_dir, self.image)
+            else:
+                res = _unpack(self.packed, self.image)
+        except (OSError, struct.error, zlib.error, ValueError) as e:
+            res = {"rc": 1, "out": str(e)}
+        self.cache_miss = res.pop("cache_miss", False)
+        res["time"] = round(time.time() - start, 6)
+        return self._step("stage", res)
+
+    def _prepare(self):
+        start = time.time()
+        try:
+            shutil.rmtree(self.mount_at, ignore_errors=True)
+            os.makedirs(self.mount_at, exist_ok=True)
+            res = {"rc": 0, "out": ""}
+        except OSError as e:
+            res = {"rc": 1, "out": str(e)}
+        res["time"] = round(time.time() - start, 6)
+        return self._step("prepare", res)
+
+    def _detect(self):
+        res = _run(["/usr/bin/file", "-b", self.image], self.step_timeout)
+        out = res["out"]
+        if not self.fs_type:
+            match = re.search(r"ext[1-4] filesystem data", out)
+            if match:
+                self.fs_type = match.group(0).split()[0]
+            elif "Unix Fast File system" in out:
+                self.fs_type = "ufs"
+            elif "data" in out:
+                self.fs_type = "zfs"
+        res["fs_type"] = self.fs_type
+        return self._step("detect", res)
+
+    def _mount_switch(self):
+        if self.fs_type in ["ext2", "ext3", "ext4"]:
+            return "ext2fs"
+        if self.fs_type == "ufs":
+            return "ufs"
+        return "auto"
+
+    def _attach(self):
+        res = _run(["/sbin/mdconfig", "-a", "-t", "vnode", "-f", self.image], self.step_timeout)
+        if res["rc"] == 0:
+            self.dev = os.path.join("/dev", res["out"])
+        return self._step("attach", res)
+
+    def _open_kcov(self):
+        start = time.time()
+        try:
+            self.kcov = Kcov()
+            res = {"rc": 0, "out": ""}
+        except OSError as e:
+            res = {"rc": 1, "out": str(e)}
+        res["time"] = round(time.time() - start, 6)
+        return self._step("kcov", res)
+
+    def _mount(self):
+        if self.kcov and self._mount_switch() != "auto":
+            # the syscall has to come from a traced thread of this process, /sbin/mount would not be covered
+            res = self.kcov.traced(lambda: _nmount(self._mount_switch(), self.dev, self.mount_at), self.mount_timeout)
+            return self._step("mount", res)
+        return self._step("mount", _run(["/sbin/mount", "-t", self._mount_switch(), self.dev, self.mount_at], self.mount_timeout))
+
+    def _ops(self):
+        rcs = []
+
+        def run():
+            return _run_ops(self.ops, self.mount_at, rcs)
+
+        res = self.kcov.traced(run, self.step_timeout) if self.kcov else _threaded(run, self.step_timeout)
+        res["rcs"] = list(rcs)
+        return self._step("workload", res)
+
+    def _workload(self):
+        ok = True
+        if self.ops:
+            ok &= self._ops()
+        for i, cmd in enumerate(self.workload):
+            ok &= self._step(f"workload_{i}", _run(["/bin/sh", "-c", cmd], self.step_timeout, cwd=self.mount_at))
+        return ok
+
+    def _unmount(self):
+        if self.kcov:
+            return self._step("unmount", self.kcov.traced(lambda: _unmount(self.mount_at), self.mount_timeout))
+        return self._step("unmount", _run(["/sbin/umount", "-f", self.mount_at], self.mount_timeout))
+
+    def _detach(self):
+        return self._step("detach", _run(["/sbin/mdconfig", "-d", "-u", self.dev], self.step_timeout))
+
+    def run(self):
+        start = time.time()
+        mounted = False
+        if self.kcov_enabled:
+            self._open_kcov()
+        if self._stage() and self._prepare() and self._detect() and self._attach():
+            mounted = self._mount()
+            if mounted:
+                self._workload()
+                self._unmount()
+            self._detach()
+        res = {
+            "image": self.image,
+            "fs_type": self.fs_type,
+            "mounted": mounted,
+            "cache_miss": self.cache_miss,
+            "ok": all(s["ok"] for s in self.steps),
+            "steps": self.steps,
+            "total": round(time.time() - start, 6),
+            "kernel": " ".join(os.uname()[2:4]),  # release and build string, keys the host's result cache
+        }
+        if self.kcov:
+            res["coverage"] = self.kcov.result()
+            self.kcov.close()
+        return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remote test case agent")
+    parser.add_argument("--image", "-i", required=True, help="Test case on the target")
+    parser.add_argument("--mount", "-m", required=True, help="Mount point on the target")
+    parser.add_argument("--fs_type", "-ft", default=None, help="Skip the detection and use this file system type")
+    parser.add_argument("--workload", "-w", action="append", default=[], help="Shell command to run inside the mount")
+    parser.add_argument("--ops", "-o", default=None, help="Encoded file system ops to run inside the mount, see fs_workload.py")
+    parser.add_argument("--patch", "-p", default=None, help="Rebuild the image from a cached base and this patch first")
+    parser.add_argument("--unpack", "-u", default=None, help="Expand this sparse packed image to --image first")
+    parser.add_argument("--kcov", "-k", action="store_true", help="Collect kernel coverage of mount, workload and unmount")
+    parser.add_argument("--cache_dir", default=CACHE_DIR, help="Base image cache, files are named by sha256")
+    parser.add_argument("--step_timeout", type=float, default=STEP_TIMEOUT)
+    parser.add_argument("--mount_timeout", type=float, default=MOUNT_TIMEOUT)
+    args = parser.parse_args()
+
+    res = Agent(
+        args.image,
+        args.mount,
+        fs_type=args.fs_type,
+        workload=args.workload,
+        ops=_decode_ops(args.ops) if args.ops else None,
+        step_timeout=args.step_timeout,
+        mount_timeout=args.mount_timeout,
+        patch=args.patch,
+        cache_dir=args.cache_dir,
+        packed=args.unpack,
+        kcov=args.kcov,
+    ).run()
+    print(json.dumps(res, separators=(",", ":")))
+    sys.stdout.flush()
+    # threads and children stuck in the kernel must not keep the agent from exiting
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,689 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from fs_checkpoint import CHECKPOINT_INTERVAL, CheckpointError, load_checkpoint, rng_state, save_checkpoint, set_rng_state
+from fs_corpus import SCHEDULES, Corpus
+from fs_crash_db import CrashDB
+from fs_coverage import CoverageMap, ReplayCoverage, result_edges
+from fs_fuzzer import Fuzzer
+from fs_metrics import INTERVAL, Metrics
+from fs_prefilter import KEEP_SHARE, POLICIES, PreFilter, detect_path
+from fs_result_cache import MAX_ENTRIES, ResultCache, cache_key, kernel_id
+from fs_scheduler import PROBE_INTERVAL, RECOVER_TIMEOUT, Target, is_reachable, load_targets
+from fs_vmctl import VirshControl
+from fs_workload import WORKLOAD_OPS
+
+QUEUE_SIZE = 4
+STAGED_AHEAD = 1
+# one slot runs, one waits staged, one is being uploaded
+SLOTS = STAGED_AHEAD + 2
+MAX_FLIPS = 16
+OUTCOMES = ["ok", "rejected", "hang", "crash", "error", "filtered"]
+OPERATORS = ["bitflip", "byte", "word", "block"]  # op numbers of mutate()
+TARGET_STATS = ["execs", "deaths", "resets", "reset_time", "exec_time"]
+
+
+@dataclass
+class Mutant:
+    id: int
+    path: str
+    seed: str
+    mseed: int  # the mutant is fully determined by its seed image and this number
+    user_sim: bool = False
+    digest: Optional[bytes] = None
+    target: Optional[str] = None
+    slot: Optional[str] = None
+    epoch: int = 0
+    staged: bool = False
+    patch: Optional[str] = None
+    packed: Optional[str] = None
+    outcome: Optional[str] = None
+    prefilter: Optional[str] = None
+    cached: bool = False
+    skipped: bool = False  # same image as an earlier mutant, never ran
+    operators: list = field(default_factory=list)
+    new_edges: int = 0
+    promoted: Optional[str] = None
+    result: Optional[dict] = field(default=None, repr=False)
+    times: dict = field(default_factory=dict)
+
+
+def mutate(data: bytearray, rng: random.Random, max_flips=MAX_FLIPS, applied=None):
+    # Same value kinds as fs_mutator.py, but driven by a seeded rng so every mutant can be rebuilt
+    for _ in range(rng.randint(1, max_flips)):
+        op = rng.randrange(4)
+        if applied is not None:
+            applied.add(OPERATORS[op])
+        if op == 0:
+            pos = rng.randrange(len(data))
+            data[pos] ^= 1 << rng.randrange(8)
+        elif op == 1:
+            pos = rng.randrange(len(data))
+            data[pos] = rng.choice([0x00, 0xFF, 0x7F, 0x80])
+        else:
+            n = rng.choice([2, 4, 8]) if op == 2 else 64
+            n = min(n, len(data))
+            pos = rng.randrange(len(data) - n + 1)
+            data[pos : pos + n] = rng.choice([bytes(n), b"\xFF" * n, rng.randbytes(n)])
+    return data
+
+
+def mk_mutant(seed, mseed, out, radamsa=False, max_flips=MAX_FLIPS, applied=None):
+    # Returns the digest of the mutant for deduplication, the names of the operators used are added to applied
+    if radamsa:
+        if applied is not None:
+            applied.add("radamsa")
+        with open(out, "wb") as f:
+            subprocess.run(["radamsa", "-s", str(mseed), seed], stdout=f, check=True)
+        with open(out, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).digest()
+    with open(seed, "rb") as f:
+        data = mutate(bytearray(f.read()), random.Random(mseed), max_flips, applied)
+    with open(out, "wb") as f:
+        f.write(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def classify(fuzzer: Fuzzer, res):
+    if res is None or fuzzer.last_outcome in ["crash", "hang"]:
+        return fuzzer.last_outcome or "crash"
+    return "ok" if res.get("mounted") else "rejected"
+
+
+class Campaign:
+    # generate -> stage (upload) -> execute -> triage, every arrow is a bounded queue, so a slow stage stalls the ones
+    # before it instead of piling up mutants on disk. Each target has its own stager/executor pair and keeps
+    # STAGED_AHEAD test cases uploaded while the current one runs.
+    def __init__(
+        self,
+        targets,
+        seeds,
+        out_dir,
+        seed=None,
+        iterations=None,
+        queue_size=QUEUE_SIZE,
+        user_sim=False,
+        radamsa=False,
+        max_flips=MAX_FLIPS,
+        delta=True,
+        metrics=None,
+        metrics_interval=INTERVAL,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        kcov=False,
+        coverage_replay=None,
+        schedule="fast",
+        prefilter="off",
+        prefilter_workers=None,
+        keep_share=KEEP_SHARE,
+        result_cache=None,
+        cache_size=MAX_ENTRIES,
+        cache_ttl=None,
+        crash_db=None,
+    ):
+        self.targets = targets
+        self.out_dir = out_dir
+        self.rng = random.Random(seed)
+        # own rng: how many bits a weighted pick draws depends on the energies, the mutant numbers must not
+        self.corpus = Corpus(schedule, rng=random.Random(self.rng.getrandbits(64)))
+        for s in seeds:
+            self.corpus.add(os.path.abspath(s))
+        self.iterations = iterations
+        self.queue_size = queue_size
+        self.user_sim = user_sim
+        self.radamsa = radamsa
+        self.max_flips = max_flips
+        self.delta = delta
+        self.next_id = 0
+        self.seen = set()
+        self.pending = {}  # generated, but not triaged yet
+        self.backlog = []  # pending mutants of a resumed campaign, they go first
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.resumed = 0
+        self.start = None
+        self.checkpoint_path = os.path.join(out_dir, "checkpoint.json")
+        self.checkpoint_interval = checkpoint_interval
+        self.work_dir = os.path.join(out_dir, "work")
+        self.crash_dir = os.path.join(out_dir, "crashes")
+        self.hang_dir = os.path.join(out_dir, "hangs")
+        self.corpus_dir = os.path.join(out_dir, "corpus")
+        self.kcov = kcov
+        self.replay = ReplayCoverage(coverage_replay) if coverage_replay else None
+        self.coverage = CoverageMap()
+        self.results_log = os.path.join(out_dir, "results.jsonl")
+        self.metrics = metrics or Metrics(
+            os.path.join(out_dir, "metrics.json"), os.path.join(out_dir, "metrics.prom"), interval=metrics_interval
+        )
+        self.prefilter = PreFilter(prefilter, prefilter_workers, keep_share) if prefilter != "off" else None
+        self._fs_types = {}
+        self._prefilter_done = 0
+        self.cache = ResultCache(result_cache, max_entries=cache_size, ttl=cache_ttl) if result_cache else None
+        self._kernels = {t.name: None for t in targets}  # last build a target reported
+        self._builds = {t.name: None for t in targets}
+        self.crash_db = CrashDB(crash_db) if crash_db else None
+        self.vmctl = {
+            t.name: VirshControl(t.domain, snapshot=t.snapshot, host=t.host, port=t.port) if t.domain else None for t in targets
+        }
+        self._epochs = {t.name: 0 for t in targets}
+        self._pool = ThreadPoolExecutor(max_workers=2 * len(targets) + 1)
+        self.pre_q = self.gen_q = self.triage_q = None
+
+    async def _blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def _timed(self, m: Mutant, stage, fn, *args):
+        start = time.monotonic()
+        try:
+            return await self._blocking(fn, *args)
+        finally:
+            m.times[stage] = m.times.get(stage, 0.0) + time.monotonic() - start
+
+    def _fuzzer(self, target: Target, m: Mutant):
+        fuzzer = Fuzzer(
+            host=target.host,
+            port=target.port,
+            fn=[m.path, m.slot],
+            ft=None,
+            mntpt=target.mount_at,
+            user_sim=m.user_sim,
+            agent=True,
+            base=m.seed if self.delta else None,
+            compress=target.compress,
+            level=target.level,
+            vmctl=self.vmctl[target.name],
+            kcov=self.kcov,
+            # the mutant number also picks the workload, so a result replays from (seed, mseed) alone
+            workload_seed=m.mseed,
+        )
+        fuzzer.vm_user = target.user
+        fuzzer.vm_password = target.password
+        return fuzzer
+
+    def _stage(self, target: Target, m: Mutant):
+        m.patch, m.packed = self._fuzzer(target, m).stage()
+        m.staged = True
+
+    def _execute(self, target: Target, m: Mutant):
+        fuzzer = self._fuzzer(target, m)
+        m.result = fuzzer.execute(m.patch, m.packed)
+        m.outcome = classify(fuzzer, m.result)
+
+    def _wait_alive(self, target: Target):
+        deadline = time.monotonic() + RECOVER_TIMEOUT
+        while time.monotonic() < deadline:
+            if is_reachable(target.host, target.port):
+                return True
+            time.sleep(PROBE_INTERVAL)
+        return False
+
+    def _next_mutant(self):
+        mid = self.next_id
+        self.next_id += 1
+        seed = self.corpus.path(self.corpus.choose())
+        mseed = self.rng.getrandbits(64)
+        m = Mutant(mid, os.path.join(self.work_dir, f"{mid:08d}"), seed, mseed, self.user_sim)
+        self.pending[mid] = m
+        return m
+
+    async def _generate(self):
+        while True:
+            if self.backlog:
+                m = self.backlog.pop(0)
+            elif self.iterations is None or self.next_id < self.iterations:
+                m = self._next_mutant()
+            else:
+                break
+            start = time.monotonic()
+            applied = set()
+            m.digest = await self._blocking(mk_mutant, m.seed, m.mseed, m.path, self.radamsa, self.max_flips, applied)
+            m.operators = sorted(applied)
+            m.times["generate"] = time.monotonic() - start
+            if m.digest in self.seen:
+                # e.g. flips that cancel out or radamsa returning the seed unchanged. Triage logs it, so a resumed
+                # campaign does not generate and run it again
+                os.unlink(m.path)
+                m.skipped = True
+                await self.triage_q.put(m)
+                continue
+            self.seen.add(m.digest)
+            await (self.pre_q if self.prefilter else self.gen_q).put(m)
+        if self.prefilter:
+            for _ in range(self.prefilter.workers):
+                await self.pre_q.put(None)
+        else:
+            for _ in self.targets:
+                await self.gen_q.put(None)
+
+    def _fs_type(self, seed):
+        # from the seed, the magic of the mutant may be gone
+        if seed not in self._fs_types:
+            self._fs_types[seed] = detect_path(seed)
+        return self._fs_types[seed]
+
+    async def _prefilterer(self):
+        while True:
+            m = await self.pre_q.get()
+            if m is None:
+                break
+            start = time.monotonic()
+            res = await asyncio.wrap_future(self.prefilter.submit(m.path, self._fs_type(m.seed)))
+            m.times["prefilter"] = time.monotonic() - start
+            m.prefilter = res["verdict"]
+            # drawn from the mutant number, so the decision does not depend on the completion order
+            if self.prefilter.keep(m.prefilter, (m.mseed & 0xFFFFFFFF) / (1 << 32)):
+                await self.gen_q.put(m)
+            else:
+                logging.debug(f"Dropped mutant {m.id}: {res['reason']}")
+                m.outcome = "filtered"
+                await self.triage_q.put(m)
+        self._prefilter_done += 1
+        if self._prefilter_done == self.prefilter.workers:
+            for _ in self.targets:
+                await self.gen_q.put(None)
+
+    def _cache_key(self, kernel, m: Mutant):
+        # everything that decides the outcome besides the image: the workload and whether kcov was on
+        workload = f"ops{WORKLOAD_OPS}.{m.mseed}" if m.user_sim else "none"
+        return cache_key(kernel, m.digest, workload + (".kcov" if self.kcov else ""))
+
+    def _cached(self, target: Target, m: Mutant):
+        kernel = self._kernels[target.name]
+        hit = self.cache.get(self._cache_key(kernel, m)) if kernel else None
+        if hit:
+            m.cached = True
+            m.target = target.name
+            m.outcome = hit["outcome"]
+            m.result = hit["result"]
+        return m.cached
+
+    async def _stager(self, target: Target, ready: asyncio.Queue):
+        slot = 0
+        while True:
+            m = await self.gen_q.get()
+            if m is None:
+                await ready.put(None)
+                return
+            if self.cache and self._cached(target, m):
+                # known outcome on this build, neither uploaded nor run
+                await ready.put(m)
+                continue
+            m.target = target.name
+            m.slot = f"{target.rfile}.{slot}"
+            slot = (slot + 1) % SLOTS
+            m.epoch = self._epochs[target.name]
+            try:
+                await self._timed(m, "upload", self._stage, target, m)
+            except Exception as e:
+                # the executor retries, the target is probably rebooting right now
+                logging.debug(f"Staging {m.path} on {target.name} failed: {e!r}")
+                m.staged = False
+            await ready.put(m)
+
+    async def _executor(self, target: Target, ready: asyncio.Queue):
+        while True:
+            m = await ready.get()
+            if m is None:
+                await self.triage_q.put(None)
+                return
+            if m.cached:
+                await self.triage_q.put(m)
+                continue
+            target.state = "busy"
+            vmctl = self.vmctl[target.name]
+            resets = len(vmctl.latencies) if vmctl else 0
+            try:
+                if not m.staged or m.epoch != self._epochs[target.name]:
+                    # uploaded before the last crash, a restored snapshot does not have it
+                    await self._timed(m, "upload", self._stage, target, m)
+                await self._timed(m, "execute", self._execute, target, m)
+            except Exception as e:
+                logging.warning(f"{target.name} failed on {m.path}: {e!r}")
+                m.outcome = "error"
+            if (m.result or {}).get("kernel"):
+                self._builds[target.name] = m.result["kernel"]
+                if self.cache:
+                    self._kernels[target.name] = kernel_id(m.result["kernel"])
+                    self.cache.use_kernel(self._kernels[target.name])
+            target.execs += 1
+            target.exec_time += m.times.get("execute", 0.0)
+            target.last_seen = time.time()
+            if m.outcome in ["crash", "hang", "error"]:
+                self._epochs[target.name] += 1
+                if m.outcome == "crash":
+                    target.deaths += 1
+                if vmctl:
+                    for took in vmctl.latencies[resets:]:
+                        self.metrics.reset(target.name, took)
+                    target.resets = len(vmctl.latencies)
+                    target.reset_time = sum(vmctl.latencies)
+                target.state = "quarantined"
+                if not await self._blocking(self._wait_alive, target):
+                    logging.warning(f"{target.name} did not come back within {RECOVER_TIMEOUT}s")
+            target.state = "idle"
+            await self.triage_q.put(m)
+
+    def _edges(self, m: Mutant):
+        if self.replay:
+            return self.replay.edges(f"{m.id:08d}")
+        return result_edges(m.result)
+
+    def _log_skip(self, m: Mutant, log):
+        log.write(json.dumps({"id": m.id, "seed": m.seed, "mseed": m.mseed, "digest": m.digest.hex(), "skipped": True}) + "\n")
+        log.flush()
+
+    def _triage_one(self, m: Mutant, log):
+        if m.new_edges and m.outcome in ["ok", "rejected"]:
+            # reached new kernel code without killing the target, becomes a seed itself
+            m.promoted = os.path.join(self.corpus_dir, f"{m.id:08d}_{m.mseed:016x}")
+            shutil.copyfile(m.path, m.promoted)
+        if m.outcome in ["crash", "hang"]:
+            dst = self.crash_dir if m.outcome == "crash" else self.hang_dir
+            name = f"{m.id:08d}_{os.path.basename(m.seed)}_{m.mseed:016x}"
+            shutil.move(m.path, os.path.join(dst, name))
+            m.path = os.path.join(dst, name)
+        elif os.path.exists(m.path):
+            os.unlink(m.path)
+        keys = ["id", "seed", "mseed", "target", "outcome", "prefilter", "cached", "new_edges", "promoted", "times"]
+        rec = {k: v for k, v in asdict(m).items() if k in keys}
+        rec["digest"] = m.digest.hex()
+        log.write(json.dumps(rec) + "\n")
+        log.flush()
+
+    async def _triage(self):
+        done = 0
+        with open(self.results_log, "a") as log:
+            while done < len(self.targets):
+                m = await self.triage_q.get()
+                if m is None:
+                    done += 1
+                    continue
+                if m.skipped:
+                    await self._blocking(self._log_skip, m, log)
+                    del self.pending[m.id]
+                    self.metrics.skip()
+                    continue
+                if m.outcome != "filtered":
+                    # read in the pool, merged here: state() and the metrics read the coverage map on the loop as well
+                    m.new_edges = self.coverage.merge(await self._blocking(self._edges, m))
+                await self._blocking(self._triage_one, m, log)
+                del self.pending[m.id]
+                if self.cache and not m.cached and m.target and self._kernels[m.target]:
+                    # crashes have no result, they count for the build the target ran before
+                    kernel = kernel_id(m.result["kernel"]) if (m.result or {}).get("kernel") else self._kernels[m.target]
+                    self.cache.put(self._cache_key(kernel, m), kernel, m.outcome, m.result)
+                took = None if m.cached else m.times.get("execute", 0.0)
+                self._record_seed(m.seed, m.outcome, took, m.new_edges, m.promoted, m.prefilter)
+                self.metrics.coverage(self.coverage.count(), bool(m.promoted), len(self.corpus))
+                self.counts[m.outcome] += 1
+                for stage, took in m.times.items():
+                    self.metrics.observe(stage, took)
+                for step in (m.result or {}).get("steps", []):
+                    self.metrics.observe(step["name"].split("_")[0], step["time"])
+                if m.prefilter:
+                    self.metrics.prefilter(m.prefilter, m.outcome == "filtered")
+                if m.cached:
+                    self.metrics.cache_hit()
+                elif m.outcome != "filtered":
+                    self.metrics.outcome(m.outcome)
+                if m.outcome == "crash" and self.crash_db:
+                    self._record_crash(m)
+                if m.outcome in ["crash", "hang"]:
+                    how = "known from the result cache" if m.cached else f"on {m.target}"
+                    print(f"[!] {m.outcome} {how}: mutant {m.id} of {os.path.basename(m.seed)} ({m.mseed:016x})")
+                n = sum(self.counts.values())
+                if n % 100 == 0:
+                    print(f"[*] {self.status()}")
+
+    def _record_crash(self, m: Mutant):
+        # panic, stack hash and cluster follow when the core.txt reports are ingested, see fs_crash_db.py
+        self.crash_db.add(
+            m.operators,
+            campaign=os.path.abspath(self.out_dir),
+            mutant=m.id,
+            seed=m.seed,
+            mseed=f"{m.mseed:016x}",
+            image=m.path,
+            target=m.target,
+            fs=self._fs_type(m.seed),
+            # crashes have no result, the build is the one the target reported last
+            kernel=(m.result or {}).get("kernel") or self._builds.get(m.target),
+        )
+
+    def _credit_buckets(self):
+        # Panics are only known once the core.txt reports are ingested into the crash database, the seed of the
+        # first crash of a new bucket gets the credit then
+        n = 0
+        for bucket, seed in self.crash_db.first_crashes(os.path.abspath(self.out_dir)):
+            if seed in self.corpus.index:
+                n += self.corpus.found_bucket(self.corpus.index[seed], bucket)
+        return n
+
+    def _record_seed(self, seed, outcome, took, new_edges, promoted, verdict=None):
+        idx = self.corpus.index[seed]
+        if verdict:
+            self.corpus.prefiltered(idx, verdict)
+        if outcome in ["error", "filtered"]:
+            return  # says nothing about the seed, or it never ran
+        if took is not None:
+            self.corpus.record(idx, took, outcome, new_edges)
+        if promoted:
+            self.corpus.add(promoted, parent=idx)
+
+    def status(self):
+        n = sum(self.counts.values())
+        took = time.monotonic() - self.start
+        counts = ", ".join(f"{k}={v}" for k, v in self.counts.items())
+        return f"{n} execs, {n - self.resumed} in {took:.1f}s ({(n - self.resumed) / took:.2f} execs/s), {counts}"
+
+    def state(self):
+        # Taken on the event loop, nothing else mutates the campaign in between
+        pending = sorted(self.pending.values(), key=lambda m: m.id)
+        # a skipped mutant shares its digest with one that did run
+        pending_digests = {m.digest for m in pending if not m.skipped}
+        return {
+            "corpus": self.corpus.state(),
+            "next_id": self.next_id,
+            "rng": rng_state(self.rng),
+            "pending": [[m.id, m.seed, m.mseed] for m in pending],
+            "seen": [d.hex() for d in self.seen if d not in pending_digests],
+            "counts": self.counts,
+            "coverage": self.coverage.to_hex(),
+            "targets": {t.name: {k: getattr(t, k) for k in TARGET_STATS} for t in self.targets},
+        }
+
+    def restore(self, state):
+        self.corpus.restore(state["corpus"])
+        self.next_id = state["next_id"]
+        set_rng_state(self.rng, state["rng"])
+        self.seen = {bytes.fromhex(d) for d in state["seen"]}
+        self.counts.update(state["counts"])
+        self.coverage = CoverageMap.from_hex(state["coverage"])
+        for t in self.targets:
+            for k, v in state["targets"].get(t.name, {}).items():
+                setattr(t, k, v)
+        pending = {
+            mid: Mutant(mid, os.path.join(self.work_dir, f"{mid:08d}"), seed, mseed, self.user_sim)
+            for mid, seed, mseed in state["pending"]
+        }
+        # results.jsonl is flushed per test case, anything triaged or skipped as a duplicate after the checkpoint must not
+        # run again. That includes mutants generated after the checkpoint was taken, their ids are at or above next_id
+        later = set()
+        if os.path.isfile(self.results_log):
+            with open(self.results_log) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    if "digest" in rec:
+                        self.seen.add(bytes.fromhex(rec["digest"]))
+                    if rec.get("skipped"):
+                        if rec["id"] >= self.next_id:
+                            later.add(rec["id"])
+                        pending.pop(rec["id"], None)
+                        continue
+                    if rec["id"] >= self.next_id and rec["id"] not in later:
+                        later.add(rec["id"])
+                    elif not pending.pop(rec["id"], None):
+                        continue
+                    self.counts[rec["outcome"]] += 1
+                    took = None if rec.get("cached") else rec["times"].get("execute", 0.0)
+                    self._record_seed(
+                        rec["seed"], rec["outcome"], took, rec["new_edges"], rec["promoted"], rec.get("prefilter")
+                    )
+        if later:
+            # the mutant numbers are drawn from self.rng alone, drawing them again keeps it in step. The ones in between
+            # that were still in flight run again, only their seed is picked anew
+            for mid in range(self.next_id, max(later) + 1):
+                mseed = self.rng.getrandbits(64)
+                if mid not in later:
+                    seed = self.corpus.path(self.corpus.choose())
+                    pending[mid] = Mutant(mid, os.path.join(self.work_dir, f"{mid:08d}"), seed, mseed, self.user_sim)
+            self.next_id = max(later) + 1
+        self.pending = pending
+        self.backlog = list(pending.values())
+        self.resumed = sum(self.counts.values())
+
+    async def checkpoint(self):
+        if self.crash_db:
+            self.crash_db.flush()
+            self._credit_buckets()
+        state = self.state()
+        if self.cache:
+            self.cache.commit()
+        await self._blocking(save_checkpoint, self.checkpoint_path, state)
+
+    async def _checkpointer(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self.checkpoint()
+
+    async def run(self, resume=False):
+        for d in [self.work_dir, self.crash_dir, self.hang_dir, self.corpus_dir]:
+            os.makedirs(d, exist_ok=True)
+        if resume:
+            state = load_checkpoint(self.checkpoint_path)
+            if state:
+                self.restore(state)
+                print(f"[+] Resuming at mutant {self.next_id}, {len(self.backlog)} pending, {self.resumed} done")
+        self.start = time.monotonic()
+        self.metrics.start_writer()
+        self.gen_q = asyncio.Queue(maxsize=self.queue_size)
+        self.pre_q = asyncio.Queue(maxsize=self.queue_size)
+        self._prefilter_done = 0
+        self.triage_q = asyncio.Queue(maxsize=self.queue_size)
+        tasks = [asyncio.create_task(self._generate()), asyncio.create_task(self._triage())]
+        if self.prefilter:
+            tasks += [asyncio.create_task(self._prefilterer()) for _ in range(self.prefilter.workers)]
+        for t in self.targets:
+            ready = asyncio.Queue(maxsize=STAGED_AHEAD)
+            tasks += [asyncio.create_task(self._stager(t, ready)), asyncio.create_task(self._executor(t, ready))]
+        checkpointer = asyncio.create_task(self._checkpointer())
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            checkpointer.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(checkpointer, *tasks, return_exceptions=True)
+            # also on Ctrl-C, the in flight mutants are pending in the checkpoint and run again on resume
+            save_checkpoint(self.checkpoint_path, self.state())
+            self._pool.shutdown(wait=False)
+            if self.prefilter:
+                self.prefilter.shutdown()
+            if self.cache:
+                self.cache.close()
+            if self.crash_db:
+                self.crash_db.close()
+            self.metrics.stop_writer()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long running fuzzing campaign over a pool of target vms")
+    parser.add_argument("--config", "-c", required=True, type=str, help="JSON file with a 'targets' list")
+    parser.add_argument("--seeds", "-s", nargs="+", help="Seed images, e.g. from fs_generator.py")
+    parser.add_argument("--out", "-o", type=str, default="campaign", help="Output directory. Default: %(default)s")
+    parser.add_argument("--iterations", "-n", type=int, default=None, help="Stop after this many mutants")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the campaign rng")
+    parser.add_argument("--queue_size", "-q", type=int, default=QUEUE_SIZE, help="Default: %(default)s")
+    parser.add_argument("--max_flips", type=int, default=MAX_FLIPS, help="Default: %(default)s")
+    parser.add_argument("--radamsa", "-rd", action="store_true", help="Mutate with radamsa instead of the builtin mutator")
+    parser.add_argument("--user_interaction", "-ui", action="store_true", help="Run the user interaction after mounting")
+    parser.add_argument(
+        "--metrics_interval", type=float, default=INTERVAL, help="Rewrite metrics.json/.prom this often. Default: %(default)ss"
+    )
+    parser.add_argument("--checkpoint_interval", type=float, default=CHECKPOINT_INTERVAL, help="Default: %(default)ss")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="fast", help="Power schedule. Default: %(default)s")
+    parser.add_argument(
+        "--prefilter", "-pf", choices=POLICIES, default="off", help="Local fsck pre-filter policy. Default: %(default)s"
+    )
+    parser.add_argument("--prefilter_workers", "-pw", type=int, default=None, help="Pre-filter processes. Default: cpu count")
+    parser.add_argument(
+        "--keep_share", type=float, default=KEEP_SHARE, help="Share of rejected mutants run with -pf weight. Default: %(default)s"
+    )
+    parser.add_argument("--result_cache", "-rc", type=str, help="sqlite file with the results of earlier campaigns")
+    parser.add_argument("--cache_size", type=int, default=MAX_ENTRIES, help="Cached results. Default: %(default)s")
+    parser.add_argument("--cache_ttl", type=float, default=None, help="Drop results of replaced kernel builds after this")
+    parser.add_argument("--crash_db", "-cd", type=str, help="sqlite file to record crashes in, see fs_crash_db.py")
+    parser.add_argument("--kcov", "-k", action="store_true", help="Collect kernel coverage, promote mutants with new edges")
+    parser.add_argument("--coverage_replay", type=str, help="Replay recorded coverage from <dir>/<mutant id>.edges instead")
+    parser.add_argument("--resume", "-r", action="store_true", help="Continue from <out>/checkpoint.json")
+    parser.add_argument("--no_delta", action="store_true", help="Always upload whole images")
+    args = parser.parse_args()
+    if not args.seeds and not args.resume:
+        parser.error("--seeds is required unless resuming")
+
+    logging.basicConfig(level="INFO")
+    campaign = Campaign(
+        load_targets(args.config),
+        args.seeds or [],
+        args.out,
+        seed=args.seed,
+        iterations=args.iterations,
+        queue_size=args.queue_size,
+        user_sim=args.user_interaction,
+        radamsa=args.radamsa,
+        max_flips=args.max_flips,
+        delta=not args.no_delta,
+        metrics_interval=args.metrics_interval,
+        checkpoint_interval=args.checkpoint_interval,
+        kcov=args.kcov,
+        coverage_replay=args.coverage_replay,
+        schedule=args.schedule,
+        prefilter=args.prefilter,
+        prefilter_workers=args.prefilter_workers,
+        keep_share=args.keep_share,
+        result_cache=args.result_cache,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        crash_db=args.crash_db,
+    )
+    try:
+        asyncio.run(campaign.run(resume=args.resume))
+    except KeyboardInterrupt:
+        print("[!] Interrupted")
+    except CheckpointError as e:
+        print(f"[!] Cannot resume: {e}")
+        return 1
+    print(f"[+] {campaign.status()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import json
+import os
+
+VERSION = 2
+CHECKPOINT_INTERVAL = 60
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def save_checkpoint(path, state):
+    # tmp file + fsync + rename, a crash in between leaves the previous checkpoint intact
+    state = dict(state, version=VERSION)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except ValueError as e:
+        raise CheckpointError(f"{path} is corrupt: {e}")
+    if state.get("version") != VERSION:
+        raise CheckpointError(f"{path} has version {state.get('version')}, expected {VERSION}")
+    return state
+
+
+def rng_state(rng):
+    version, internal, gauss = rng.getstate()
+    return [version, list(internal), gauss]
+
+
+def set_rng_state(rng, state):
+    version, internal, gauss = state
+    rng.setstate((version, tuple(internal), gauss))
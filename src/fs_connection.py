@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import logging
+import socket
+import threading
+
+import paramiko as pm
+
+# Large windows/packets keep the SFTP pipe full when pushing multi MB images
+WINDOW_SIZE = 16 << 20
+MAX_PACKET_SIZE = 1 << 16
+CONNECT_TIMEOUT = 15
+KEEPALIVE = 30
+
+CONNECTION_ERRORS = (pm.ssh_exception.SSHException, EOFError, OSError)
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+class Connection:
+    # One authenticated transport and one SFTP session per target, reopened transparently once the target is back
+    def __init__(self, host, port=22, user="root", password="root", window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self._transport = None
+        self._sftp = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        transport = pm.Transport(sock, default_window_size=self.window_size, default_max_packet_size=self.max_packet_size)
+        try:
+            transport.start_client(timeout=CONNECT_TIMEOUT)
+            transport.auth_password(self.user, self.password)
+        except CONNECTION_ERRORS:
+            transport.close()
+            raise
+        transport.set_keepalive(KEEPALIVE)
+        logging.debug(f"New transport to {self.host}:{self.port}")
+        return transport
+
+    def transport(self):
+        with self._lock:
+            if self._transport is None or not self._transport.is_active():
+                self.close()
+                self._transport = self._connect()
+            return self._transport
+
+    def sftp(self):
+        with self._lock:
+            transport = self.transport()
+            if self._sftp is None or self._sftp.get_channel().closed:
+                self._sftp = pm.SFTPClient.from_transport(
+                    transport, window_size=self.window_size, max_packet_size=self.max_packet_size
+                )
+            return self._sftp
+
+    def exec(self, cmd, timeout=3):
+        # No PTY: a plain session is cheaper and keeps the output free of terminal translation
+        chan = self.transport().open_session(timeout=timeout)
+        try:
+            chan.settimeout(timeout)
+            chan.set_combine_stderr(True)
+            chan.exec_command(cmd)
+            out = []
+            while True:
+                data = chan.recv(65536)
+                if not data:
+                    break
+                out.append(data)
+            return chan.recv_exit_status(), b"".join(out)
+        finally:
+            chan.close()
+
+    def _retry(self, fn, *args):
+        try:
+            return fn(*args)
+        except CONNECTION_ERRORS as e:
+            # e.g. the vm was rebooted in between, try once more on a fresh transport
+            logging.debug(f"Reconnecting to {self.host} after: {e}")
+            self.close()
+            return fn(*args)
+
+    def put(self, lp, rp):
+        return self._retry(lambda: self.sftp().put(lp, rp))
+
+    def get(self, rp, lp):
+        return self._retry(lambda: self.sftp().get(rp, lp))
+
+    def putfo(self, fo, rp):
+        pos = fo.tell()
+
+        def put():
+            # a retry starts over, the failed attempt may have consumed part of fo already
+            fo.seek(pos)
+            return self.sftp().putfo(fo, rp)
+
+        return self._retry(put)
+
+    def rename(self, src, dst):
+        # atomic on the target, replaces dst if it exists
+        return self._retry(lambda: self.sftp().posix_rename(src, dst))
+
+    def close(self):
+        with self._lock:
+            if self._sftp is not None:
+                try:
+                    self._sftp.close()
+                except CONNECTION_ERRORS:
+                    pass
+                self._sftp = None
+            if self._transport is not None:
+                self._transport.close()
+                self._transport = None
+
+
+def get_connection(host, port=22, user="root", password="root"):
+    with _connections_lock:
+        key = (host, port, user)
+        if key not in _connections:
+            _connections[key] = Connection(host, port=port, user=user, password=password)
+        return _connections[key]
+
+
+def drop_connection(host, port=22, user="root"):
+    with _connections_lock:
+        conn = _connections.pop((host, port, user), None)
+    if conn:
+        conn.close()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import random
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from fs_checkpoint import rng_state, set_rng_state
+from fs_prefilter import REJECTED
+
+BASE_ENERGY = 100
+MAX_ENERGY = 1600
+MIN_ENERGY = 1
+DRY_STEP = 64
+# a seed whose mutants are all refused by the pre-filter keeps 1 - BOUNCE_PENALTY of its energy
+BOUNCE_PENALTY = 0.75
+SCHEDULES = ["fast", "explore"]
+
+
+@dataclass
+class Seed:
+    path: str
+    parent: Optional[int] = None
+    execs: int = 0
+    chosen: int = 0
+    exec_time: float = 0.0
+    new_edges: int = 0
+    new_buckets: int = 0
+    new_outcomes: int = 0
+    last_yield: int = 0  # execs at the last time a mutant of this seed found something
+    outcomes: List[str] = field(default_factory=list)
+    prefilter: Dict[str, int] = field(default_factory=dict)  # pre-filter verdicts of its mutants
+
+    def avg_exec(self):
+        return self.exec_time / self.execs if self.execs else 0.0
+
+    def yields(self):
+        return self.new_edges + 10 * self.new_buckets + self.new_outcomes
+
+
+class FenwickTree:
+    # Prefix sums over integer weights, update and weighted sampling are both O(log n)
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self.tree = [0] * (capacity + 1)
+        self.weights = []
+
+    def _grow(self):
+        weights = self.weights
+        self.tree = [0] * (2 * (len(self.tree) - 1) + 1)
+        self.n = 0
+        self.weights = []
+        for w in weights:
+            self.append(w)
+
+    def append(self, w):
+        if self.n + 1 >= len(self.tree):
+            self._grow()
+        self.n += 1
+        self.weights.append(0)
+        # a new tail node covers (i - lowbit(i), i], pull in the sums it is responsible for
+        i = self.n
+        lo = i - (i & -i)
+        j = i - 1
+        while j > lo:
+            self.tree[i] += self.tree[j]
+            j -= j & -j
+        self.update(i - 1, w)
+
+    def update(self, idx, w):
+        delta = w - self.weights[idx]
+        self.weights[idx] = w
+        i = idx + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        s, i = 0, self.n
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def find(self, target):
+        # smallest idx whose prefix sum exceeds target
+        pos = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class Corpus:
+    # AFL style power schedule: fast and productive seeds get more energy, i.e. a larger share of the mutants.
+    # The energy of a seed is refreshed whenever it is executed, not on every change of the corpus averages,
+    # which keeps every decision at O(log n) even for 100k seeds.
+    def __init__(self, schedule="fast", rng=None):
+        self.schedule = schedule
+        self.rng = rng or random.Random()
+        self.seeds: List[Seed] = []
+        self.index = {}
+        self.weights = FenwickTree()
+        self.total_execs = 0
+        self.total_time = 0.0
+        self.buckets = set()  # crash buckets already credited to a seed
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def add(self, path, parent=None, seed=None):
+        if path in self.index:
+            return self.index[path]
+        idx = len(self.seeds)
+        self.seeds.append(seed or Seed(path, parent))
+        self.index[path] = idx
+        self.weights.append(self.energy(idx))
+        return idx
+
+    def energy(self, idx):
+        s = self.seeds[idx]
+        if not s.execs:
+            # new seeds have to prove themselves first, AFL hands them extra cycles as well
+            e = 2 * BASE_ENERGY
+        else:
+            e = BASE_ENERGY
+            avg = self.total_time / self.total_execs if self.total_execs else 0.0
+            if avg:
+                e *= min(max(avg / max(s.avg_exec(), 1e-6), 0.1), 3.0)
+            e *= min(1 + 10 * s.yields() / s.execs, 8.0)
+            if self.schedule == "fast":
+                # AFLFast like: every DRY_STEP execs without any yield halve the energy, down to 1/64
+                e /= 2 ** min((s.execs - s.last_yield) // DRY_STEP, 6)
+        if s.prefilter:
+            e *= 1 - BOUNCE_PENALTY * s.prefilter.get(REJECTED, 0) / sum(s.prefilter.values())
+        return int(min(max(e, MIN_ENERGY), MAX_ENERGY))
+
+    def choose(self):
+        idx = self.weights.find(self.rng.randrange(self.weights.total()))
+        self.seeds[idx].chosen += 1
+        return idx
+
+    def record(self, idx, took, outcome=None, new_edges=0):
+        s = self.seeds[idx]
+        s.execs += 1
+        s.exec_time += took
+        s.new_edges += new_edges
+        new_outcome = outcome is not None and outcome not in s.outcomes
+        if new_outcome:
+            s.outcomes.append(outcome)
+            s.new_outcomes += 1
+        if new_edges or new_outcome:
+            s.last_yield = s.execs
+        self.total_execs += 1
+        self.total_time += took
+        self.weights.update(idx, self.energy(idx))
+
+    def found_bucket(self, idx, bucket):
+        # A crash bucket is only known once the core.txt of the crash is parsed, long after the exec was recorded
+        if bucket in self.buckets:
+            return False
+        self.buckets.add(bucket)
+        s = self.seeds[idx]
+        s.new_buckets += 1
+        s.last_yield = s.execs
+        self.weights.update(idx, self.energy(idx))
+        return True
+
+    def prefiltered(self, idx, verdict):
+        s = self.seeds[idx]
+        s.prefilter[verdict] = s.prefilter.get(verdict, 0) + 1
+        self.weights.update(idx, self.energy(idx))
+
+    def path(self, idx):
+        return self.seeds[idx].path
+
+    def paths(self):
+        return [s.path for s in self.seeds]
+
+    def state(self):
+        return {
+            "schedule": self.schedule,
+            "rng": rng_state(self.rng),
+            "seeds": [asdict(s) for s in self.seeds],
+            "buckets": sorted(self.buckets),
+        }
+
+    def restore(self, state):
+        self.__init__(state["schedule"], self.rng)
+        set_rng_state(self.rng, state["rng"])
+        self.buckets = set(state.get("buckets", []))
+        for d in state["seeds"]:
+            s = Seed(**d)
+            self.total_execs += s.execs
+            self.total_time += s.exec_time
+            self.add(s.path, seed=s)
+        # refresh with the restored averages
+        for idx in range(len(self.seeds)):
+            self.weights.update(idx, self.energy(idx))
+
+    def top(self, n=10):
+        return sorted(range(len(self.seeds)), key=lambda i: -self.weights.weights[i])[:n]
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import base64
+import json
+import os
+import struct
+
+MAP_BITS = 16  # keep in sync with fs_agent.py
+MAP_SIZE = 1 << MAP_BITS
+
+
+def _popcount(x):
+    return x.bit_count() if hasattr(x, "bit_count") else bin(x).count("1")
+
+
+def decode_edges(encoded):
+    # The agent sends the sorted, unique edge ids as little endian uint16, base64 encoded
+    raw = base64.b64decode(encoded)
+    return struct.unpack(f"<{len(raw) // 2}H", raw)
+
+
+def encode_edges(edges):
+    edges = sorted(set(edges))
+    return base64.b64encode(struct.pack(f"<{len(edges)}H", *edges)).decode()
+
+
+def to_bitmap(edges):
+    # A python int is the bitmap, so |, & and ~ run over the whole map in C instead of per edge
+    buf = bytearray(MAP_SIZE >> 3)
+    for e in edges:
+        buf[e >> 3] |= 1 << (e & 7)
+    return int.from_bytes(buf, "little")
+
+
+class CoverageMap:
+    def __init__(self, bitmap=0):
+        self.bitmap = bitmap
+
+    def new_edges(self, edges):
+        bm = to_bitmap(edges)
+        return bm & ~self.bitmap
+
+    def merge(self, edges):
+        new = self.new_edges(edges)
+        self.bitmap |= new
+        return _popcount(new)
+
+    def count(self):
+        return _popcount(self.bitmap)
+
+    def to_hex(self):
+        return self.bitmap.to_bytes(MAP_SIZE >> 3, "little").hex()
+
+    @classmethod
+    def from_hex(cls, h):
+        return cls(int.from_bytes(bytes.fromhex(h), "little"))
+
+
+class ReplayCoverage:
+    # Stand-in for kcov on the target: <dir>/<mutant name>.edges holds a json list of edge ids recorded earlier
+    def __init__(self, cov_dir):
+        self.cov_dir = cov_dir
+
+    def edges(self, name):
+        path = os.path.join(self.cov_dir, f"{name}.edges")
+        if not os.path.isfile(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def record(self, name, edges):
+        os.makedirs(self.cov_dir, exist_ok=True)
+        with open(os.path.join(self.cov_dir, f"{name}.edges"), "w") as f:
+            json.dump(sorted(set(edges)), f)
+
+
+def result_edges(res):
+    cov = (res or {}).get("coverage")
+    return decode_edges(cov["edges"]) if cov else []
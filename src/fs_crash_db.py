@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# Local crash database. The campaign records every crash with the mutant that triggered it, the bucket index of
+# testcases/core_features/extract_core_features.py (and crash_cluster.py) adds panic, stack hash and cluster once
+# the core.txt reports are in.
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+FLUSH_EVERY = 256
+TOP_BUCKETS = 20
+# campaign crash images are named <mutant id>_<seed>_<mseed>, a report below such a name belongs to that crash
+MUTANT_RE = re.compile(r"(\d{8})_[^/]*_([0-9a-f]{16})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crashes (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    campaign TEXT,
+    mutant INTEGER,
+    seed TEXT,
+    mseed TEXT,
+    image TEXT,
+    target TEXT,
+    fs TEXT,
+    kernel TEXT,
+    panic TEXT,
+    stack_hash TEXT,
+    cluster TEXT,
+    report TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS crashes_mutant ON crashes (mutant, mseed);
+CREATE INDEX IF NOT EXISTS crashes_stack ON crashes (stack_hash, time);
+CREATE TABLE IF NOT EXISTS crash_operators (
+    crash INTEGER NOT NULL REFERENCES crashes (id),
+    operator TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS crash_operators_operator ON crash_operators (operator, crash);
+CREATE TABLE IF NOT EXISTS buckets (
+    stack_hash TEXT PRIMARY KEY,
+    panic TEXT,
+    cluster TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_first_seen ON buckets (first_seen);
+CREATE INDEX IF NOT EXISTS buckets_count ON buckets (count);
+"""
+
+CRASH_COLUMNS = ["time", "campaign", "mutant", "seed", "mseed", "image", "target", "fs", "kernel"]
+
+
+class CrashDB:
+    # Crashes are buffered and written FLUSH_EVERY at a time in one transaction, call flush() to force it.
+    # The buckets table is derived from the crashes and rebuilt on every ingest
+    def __init__(self, path, flush_every=FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self._pending = []
+
+    def add(self, operators=(), **crash):
+        crash.setdefault("time", time.time())
+        self._pending.append(([crash.get(k) for k in CRASH_COLUMNS], list(operators)))
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return 0
+        ops = []
+        with self.db:
+            for row, operators in self._pending:
+                cur = self.db.execute(
+                    f"INSERT INTO crashes ({', '.join(CRASH_COLUMNS)}) VALUES ({', '.join('?' * len(CRASH_COLUMNS))})", row
+                )
+                ops += [(cur.lastrowid, op) for op in operators]
+            self.db.executemany("INSERT INTO crash_operators (crash, operator) VALUES (?, ?)", ops)
+        n, self._pending = len(self._pending), []
+        return n
+
+    def ingest(self, root, index):
+        # index is a bucket index of extract_core_features.py for the reports below root
+        self.flush()
+        linked = added = 0
+        with self.db:
+            for rel, f in index["files"].items():
+                b = index["buckets"].get(f.get("hash"))
+                if not b:
+                    continue
+                report = os.path.abspath(os.path.join(root, rel))
+                values = (b["panic"], f["hash"], b.get("cluster"))
+                sql = "UPDATE crashes SET panic = ?, stack_hash = ?, cluster = ?"
+                if self.db.execute(f"{sql} WHERE report = ?", values + (report,)).rowcount:
+                    continue
+                m = MUTANT_RE.search(report)
+                if m and self.db.execute(
+                    f"{sql}, report = ? WHERE id = (SELECT id FROM crashes WHERE mutant = ? AND mseed = ? AND report IS NULL)",
+                    values + (report, int(m.group(1)), m.group(2)),
+                ).rowcount:
+                    linked += 1
+                    continue
+                # a report of no crash we know, e.g. found while testing by hand
+                self.db.execute(
+                    "INSERT INTO crashes (time, panic, stack_hash, cluster, report) VALUES (?, ?, ?, ?, ?)",
+                    (f["sig"][1],) + values + (report,),
+                )
+                added += 1
+            self.db.execute("DELETE FROM buckets")
+            self.db.execute(
+                "INSERT INTO buckets (stack_hash, panic, cluster, first_seen, last_seen, count) "
+                "SELECT stack_hash, MAX(panic), MAX(cluster), MIN(time), MAX(time), COUNT(*) FROM crashes "
+                "WHERE stack_hash IS NOT NULL GROUP BY stack_hash"
+            )
+        return linked, added
+
+    def new_buckets(self, since):
+        return self.db.execute(
+            "SELECT stack_hash, panic, cluster, first_seen, count FROM buckets WHERE first_seen >= ? ORDER BY first_seen",
+            (since,),
+        ).fetchall()
+
+    def top_buckets(self, n=TOP_BUCKETS):
+        return self.db.execute(
+            "SELECT stack_hash, panic, cluster, first_seen, count FROM buckets ORDER BY count DESC LIMIT ?", (n,)
+        ).fetchall()
+
+    def first_crashes(self, campaign):
+        # buckets whose first crash came from this campaign, with the seed of that crash
+        return self.db.execute(
+            "SELECT c.stack_hash, c.seed FROM buckets b JOIN crashes c ON c.stack_hash = b.stack_hash AND c.time = b.first_seen "
+            "WHERE c.campaign = ? ORDER BY b.first_seen",
+            (campaign,),
+        ).fetchall()
+
+    def per_operator(self):
+        # a mutant usually applies several operators, its crash counts for each of them
+        return self.db.execute(
+            "SELECT o.operator, COUNT(*), COUNT(DISTINCT c.stack_hash) FROM crash_operators o "
+            "JOIN crashes c ON c.id = o.crash GROUP BY o.operator ORDER BY COUNT(*) DESC"
+        ).fetchall()
+
+    def stats(self):
+        q = self.db.execute
+        return {
+            "crashes": q("SELECT COUNT(*) FROM crashes").fetchone()[0],
+            "with_report": q("SELECT COUNT(*) FROM crashes WHERE report IS NOT NULL").fetchone()[0],
+            "buckets": q("SELECT COUNT(*) FROM buckets").fetchone()[0],
+            "clusters": q("SELECT COUNT(DISTINCT cluster) FROM buckets").fetchone()[0],
+            "pending": len(self._pending),
+        }
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+def parse_time(s):
+    try:
+        return float(s)
+    except ValueError:
+        return time.mktime(time.strptime(s, "%Y-%m-%d"))
+
+
+def _print_buckets(rows):
+    for h, panic, cluster, first, count in rows:
+        first = time.strftime("%Y-%m-%d %H:%M", time.localtime(first))
+        print(f"{count:6d}  {h[:16]}  {cluster or '-':6}  {first}  {panic}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the crash database of a campaign or feed it crash reports")
+    parser.add_argument("db", type=str, help="sqlite file, e.g. crashes.db")
+    parser.add_argument("action", choices=["stats", "ingest", "new", "top", "operators"])
+    parser.add_argument("path", nargs="?", help="ingest: directory bucketed with extract_core_features.py")
+    parser.add_argument("--index", "-i", default=None, help="ingest: bucket index. Default: <path>/buckets.json")
+    parser.add_argument("--since", "-s", default=None, help="new: unix time or YYYY-MM-DD. Default: 24h ago")
+    parser.add_argument("--top", "-n", type=int, default=TOP_BUCKETS, help="top: Default: %(default)s")
+    args = parser.parse_args()
+
+    if args.action != "ingest" and not os.path.isfile(args.db):
+        print(f"[!] {args.db} does not exist")
+        return 1
+    db = CrashDB(args.db)
+    if args.action == "ingest":
+        if not args.path:
+            parser.error("ingest needs the report directory")
+        with open(args.index or os.path.join(args.path, "buckets.json")) as f:
+            linked, added = db.ingest(args.path, json.load(f))
+        print(f"[+] {linked} reports linked to campaign crashes, {added} added without one")
+    elif args.action == "new":
+        _print_buckets(db.new_buckets(parse_time(args.since) if args.since else time.time() - 86400))
+    elif args.action == "top":
+        _print_buckets(db.top_buckets(args.top))
+    elif args.action == "operators":
+        for op, n, buckets in db.per_operator():
+            print(f"{n:6d}  {buckets:4d} buckets  {op}")
+    else:
+        print(json.dumps(db.stats(), indent=4))
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,65 @@
 
 import argparse
 import getpass
+import hashlib
+import io
+import json
 import logging
 import os
 import pathlib
 import re
-import socket
+import shlex
 import sys
+import threading
+import time
 
 import colorama as clr
-import paramiko as pm
+
+from fs_connection import CONNECTION_ERRORS, drop_connection, get_connection
+from fs_liveness import HANG, MISS_THRESHOLD, PROBE_INTERVAL, LivenessMonitor
+from fs_timeouts import TimeoutTracker, get_tracker
+from fs_transfer import file_digest, mk_patch, pack_sparse
+from fs_vmctl import VirshControl, VmControlError
+from fs_workload import WORKLOAD_OPS, encode, generate, parse_script, summary, to_script
+
+AGENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fs_agent.py")
+REMOTE_PYTHON = "/usr/local/bin/python3"
+AGENT_STEPS = ["stage", "prepare", "detect", "attach", "mount", "workload", "unmount", "detach"]
+REMOTE_CACHE = "/root/cache"
+# the user interaction the poc_5 image was found with, replayed as is by poc(emul=True)
+POC_CMDS = [
+    "/usr/bin/dirname /mnt/",
+    "bin/rm -rf /mnt/HITB/reFEk8zIzNNNdIHqWStDP2DXU4Em4xeIbujCvW3IoqkJFMc0VtHmZWAF3pjUGHGADqSGruv",
+]
+
+_installed_agents = set()
+_cached_bases = set()
+# stager and executor of a target may both want an uncached base at once, only one of them uploads it
+_base_locks = {}
+_base_locks_guard = threading.Lock()
 
 
 class Fuzzer:
-    def __init__(self, host, fn, ft, mntpt, user_sim, port=22):
+    def __init__(
+        self,
+        host,
+        fn,
+        ft,
+        mntpt,
+        user_sim,
+        port=22,
+        agent=False,
+        base=None,
+        compress=None,
+        level=6,
+        vmctl=None,
+        probe_interval=PROBE_INTERVAL,
+        probe_misses=MISS_THRESHOLD,
+        timeouts=None,
+        kcov=False,
+        workload_seed=0,
+        workload_ops=WORKLOAD_OPS,
+    ):
         self.host = host
         self.port = port
         self.lfile = fn[0]
@@ -24,24 +70,30 @@ class Fuzzer:
         self.vm_user = self.vm_password = "root"
         self.mount_at = mntpt
         self.user_sim = user_sim
+        self.agent = agent
+        self.base = base
+        self.compress = compress
+        self.level = level
+        self.vmctl = vmctl
+        self.monitor = LivenessMonitor(
+            host, port, interval=probe_interval, timeout=probe_interval, misses=probe_misses, on_dead=self._on_dead
+        )
+        self.ragent = None
+        self.last_result = None
+        self.last_outcome = None
+        # learned per operation, shared by all fuzzers talking to the same host
+        self.timeouts = timeouts or get_tracker(host)
+        self.hangs = []
+        self.kcov = kcov
+        self.workload_seed = workload_seed
+        self.workload_ops = workload_ops
 
     def __exit__(self):
         return 1
 
     def _get_basic_ssh_conn(self):
         self.get_vm_credentials()
-        ssh_conn = pm.SSHClient()
-        ssh_conn.set_missing_host_key_policy(pm.AutoAddPolicy())
-        ssh_conn.connect(
-            hostname=self.host,
-            port=self.port,
-            username=self.vm_user,
-            password=self.vm_password,
-            look_for_keys=False,
-            allow_agent=False,
-            timeout=15,
-        )
-        return ssh_conn
+        return get_connection(self.host, port=self.port, user=self.vm_user, password=self.vm_password)
 
     def get_vm_credentials(self):
         if self.vm_user is None or self.vm_password is None:
@@ -51,26 +103,31 @@ class Fuzzer:
             logging.debug("Reusing stored vm credentials.")
 
     def invoke_remote_ssh_shell(self):
-        ssh_conn = self._get_basic_ssh_conn()
-        ssh_conn.get_transport().set_keepalive(200)
-        ssh_conn.get_transport().open_session()
-        ssh_conn.invoke_shell()
-        self.rshell = ssh_conn
-        return ssh_conn
-
-    def _exec(self, cmd, to=3):
+        self.rshell = self._get_basic_ssh_conn()
+        self.rshell.transport()
+        return self.rshell
+
+    def _exec(self, cmd, to=None, op=None):
         if not self.rshell:
             logging.debug(f"new rshell for ... {cmd}")
-            self.invoke_remote_ssh_shell()
+            self.rshell = self._get_basic_ssh_conn()
+        op = op or os.path.basename(cmd.split()[0])
+        to = to or self.timeouts.timeout(op)
+        start = time.monotonic()
         try:
-            # get_pty=True combines stdout/stderr
-            _, stdout, _ = self.rshell.exec_command(cmd, get_pty=True, timeout=to)
-            stdout_decoded = stdout.read().decode().strip()
+            # stdout/stderr are combined on the channel
+            _, stdout = self.rshell.exec(cmd, timeout=to)
+            self.timeouts.record(op, time.monotonic() - start)
+            stdout_decoded = stdout.decode().strip()
             if stdout_decoded != "":
                 return stdout_decoded
             else:
                 return None
-        except (pm.ssh_exception.SSHException, socket.timeout, pm.ssh_exception.NoValidConnectionsError) as e:
+        except TimeoutError:
+            self.hangs.append(op)
+            self.timeouts.hang(op, time.monotonic() - start)
+            return 2
+        except CONNECTION_ERRORS as e:
             logging.debug("_EXEC ERROR: {}".format(e))
             return 2
         except UnicodeDecodeError:
@@ -111,14 +168,14 @@ class Fuzzer:
                 self.exec_cmd(command)
 
     def cp_to_local(self, rp, lp):
-        ftpc = self.rshell.open_sftp()
-        ftpc.get(rp, lp)
-        ftpc.close()
+        if not self.rshell:
+            self.invoke_remote_ssh_shell()
+        self.rshell.get(rp, lp)
 
     def cp_to_remote(self, lp, rp):
-        ftpc = self.rshell.open_sftp()
-        ftpc.put(lp, rp)
-        ftpc.close()
+        if not self.rshell:
+            self.invoke_remote_ssh_shell()
+        self.rshell.put(lp, rp)
 
     def _mk_blk_dev(self):
         logging.debug("CREATING BLKDEV FOR: {}".format(self.rfile))
@@ -177,38 +234,249 @@ class Fuzzer:
     def _unmount_ext_ufs(self):
         cmd_mount = "/sbin/umount -f {}".format(self.mount_at)
         print(cmd_mount)
-        if not self.exec_cmd_quiet(cmd_mount) and not self._umk_blk_dev():
+        # same timeout class as the agent's unmount step
+        if not self._exec(cmd_mount, op="unmount") and not self._umk_blk_dev():
             return 1  # Success
         else:
             logging.debug("Failed to properly umount {}".format(self.mount_at))
             return 0
 
+    def _on_dead(self, verdict):
+        # Runs in the monitor thread, closing the transport aborts a remote command that will never return
+        logging.debug(f"{self.host} is {verdict}")
+        drop_connection(self.host, self.port, self.vm_user)
+
     def _is_alive(self):
-        if self._exec(f"ping -c1 {self.host}", to=1) != 2:
+        if self.monitor.check():
             return 1
         else:
             return 0
 
-    def fuzz(self):
+    def recover(self):
+        if self.monitor.verdict == HANG or self.last_outcome == "hang":
+            print("[!] Target hangs..")
+        else:
+            print("[!] Target is dead..")
+        if not self.vmctl:
+            return None
+        try:
+            took = self.vmctl.recover()
+        except VmControlError as e:
+            print(f"[!] Reset failed: {e}")
+            return None
+        # the old transport points at a kernel that no longer exists
+        drop_connection(self.host, self.port, self.vm_user)
+        self.rshell = None
+        print(f"[+] Target restored in {took:.3f}s (avg {self.vmctl.avg_latency():.3f}s)")
+        return took
+
+    def install_agent(self):
+        # The remote name carries the agent's digest, so a changed agent gets uploaded again
+        digest = hashlib.md5(pathlib.Path(AGENT_PATH).read_bytes()).hexdigest()[:12]
+        self.ragent = f"/root/fs_agent_{digest}.py"
+        key = (self.host, self.port, digest)
+        if key not in _installed_agents:
+            self.cp_to_remote(AGENT_PATH, self.ragent)
+            _installed_agents.add(key)
+        return key
+
+    def stage_delta(self):
+        # Only the patch list against the cached seed goes over the wire, the agent rebuilds the mutant remotely
+        patch = mk_patch(self.base, self.lfile)
+        if len(patch) > os.path.getsize(self.lfile) >> 1:
+            return None
+        if not self.rshell:
+            self.invoke_remote_ssh_shell()
+        key = (self.host, self.port, file_digest(self.base))
+        with _base_locks_guard:
+            lock = _base_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in _cached_bases:
+                self.mkdir(REMOTE_CACHE)
+                # an interrupted upload must not leave a truncated base under its digest, it only gets the name when complete
+                rbase = f"{REMOTE_CACHE}/{key[2]}"
+                self.cp_to_remote(self.base, rbase + ".part")
+                self.rshell.rename(rbase + ".part", rbase)
+                _cached_bases.add(key)
+        rpatch = self.rfile + ".patch"
+        self.rshell.putfo(io.BytesIO(patch), rpatch)
+        return rpatch
+
+    def stage_packed(self):
+        # Holes are skipped and the data extents compressed, the agent expands it into a sparse file again
+        packed = pack_sparse(self.lfile, self.compress, self.level)
+        if not self.rshell:
+            self.invoke_remote_ssh_shell()
+        rpacked = self.rfile + ".fsz"
+        self.rshell.putfo(io.BytesIO(packed), rpacked)
+        logging.debug(f"Packed {os.path.getsize(self.lfile)} -> {len(packed)} bytes")
+        return rpacked
+
+    def upload_full(self):
+        if self.agent and self.compress:
+            return self.stage_packed()
+        self.cp_to_remote(self.lfile, self.rfile)
+        return None
+
+    def _agent_timeouts(self):
+        mount_to = max(self.timeouts.timeout("mount"), self.timeouts.timeout("unmount"))
+        step_to = max(self.timeouts.timeout(s) for s in AGENT_STEPS if s not in ["mount", "unmount"])
+        # the round trip has to outlast every remote step running into its own timeout
+        return step_to, mount_to, max(self.timeouts.timeout("agent"), 2 * mount_to + len(AGENT_STEPS) * step_to)
+
+    def _record_agent_steps(self, res):
+        for s in res["steps"]:
+            op = s["name"].split("_")[0]
+            if s["rc"] is None:
+                self.hangs.append(op)
+                self.timeouts.hang(op, s["time"])
+            else:
+                self.timeouts.record(op, s["time"])
+
+    def run_agent(self, workload=None, to=None, patch=None, packed=None, ops=None):
+        try:
+            key = self.install_agent()
+        except CONNECTION_ERRORS as e:
+            logging.debug(f"Installing the agent failed: {e}")
+            return None
+        step_to, mount_to, agent_to = self._agent_timeouts()
+        to = to or agent_to
+        cmd = f"{REMOTE_PYTHON} {self.ragent} -i {shlex.quote(self.rfile)} -m {shlex.quote(self.mount_at)}"
+        cmd += f" --step_timeout {step_to:.3f} --mount_timeout {mount_to:.3f}"
+        if self.kcov:
+            cmd += " -k"
+        if patch:
+            cmd += f" -p {shlex.quote(patch)} --cache_dir {REMOTE_CACHE}"
+        elif packed:
+            cmd += f" -u {shlex.quote(packed)}"
+        for w in workload or []:
+            cmd += f" -w {shlex.quote(w)}"
+        if ops:
+            cmd += f" -o {encode(ops)}"
+        start = time.monotonic()
+        with self.monitor:
+            out = self._exec(cmd, to=to, op="agent")
+        if self.monitor.is_dead():
+            self.rshell = None
+            return None
+        if isinstance(out, str) and "can't open file" in out:
+            # e.g. a reverted vm snapshot lost the agent
+            _installed_agents.discard(key)
+            try:
+                self.install_agent()
+            except CONNECTION_ERRORS as e:
+                logging.debug(f"Installing the agent failed: {e}")
+                return None
+            out = self._exec(cmd, to=to, op="agent")
+        if "agent" in self.hangs:
+            # the target answers, only the round trip timed out, e.g. on a mount stuck in the kernel: a hang, not a death
+            took = round(time.monotonic() - start, 6)
+            step = {"name": "agent", "rc": None, "ok": False, "out": "timeout", "time": took}
+            return {"mounted": False, "cache_miss": False, "ok": False, "steps": [step], "total": took}
+        if not isinstance(out, str):
+            return None
+        try:
+            res = json.loads(out.splitlines()[-1])
+        except ValueError:
+            logging.debug(f"Garbled agent output: {out}")
+            return None
+        self._record_agent_steps(res)
+        return res
+
+    def _fuzz_agent(self, patch=None, packed=None):
+        ops = self.user_ops()
+        self.last_result = self.run_agent(patch=patch, packed=packed, ops=ops)
+        if self.last_result is not None and self.last_result.get("cache_miss"):
+            # base vanished from the target, e.g. vm reset to an older snapshot
+            _cached_bases.discard((self.host, self.port, file_digest(self.base)))
+            try:
+                self.last_result = self.run_agent(packed=self.upload_full(), ops=ops)
+            except CONNECTION_ERRORS as e:
+                logging.debug(f"Upload failed: {e}")
+                self.last_result = None
+        if self.last_result is None:
+            self._failed()
+            return None
+        steps = ", ".join(f"{s['name']}={'ok' if s['ok'] else s['rc']} ({s['time']:.3f}s)" for s in self.last_result["steps"])
+        print(f"[*] {steps}")
+        for s in self.last_result["steps"]:
+            if "rcs" in s:
+                self._print_workload(ops, s["rcs"])
+        if "coverage" in self.last_result:
+            print(f"[*] {self.last_result['coverage']['pcs']} pcs")
+        if any(s["rc"] is None for s in self.last_result["steps"]):
+            # a step ran into its timeout, the kernel may still hold the md device or a stuck mount
+            self.last_outcome = "hang"
+            self.recover()
+        else:
+            self.last_outcome = "ok"
+        return self.last_result
+
+    def _failed(self):
+        # No result: only a crash or hang if the liveness probes agree, a dropped ssh transport or garbled agent output
+        # on a target that still answers is an error and no reason to reset it
+        if self.monitor.is_dead() or not self.monitor.check():
+            self.last_outcome = "hang" if self.monitor.verdict == HANG else "crash"
+            self.recover()
+            return
+        self.last_outcome = "error"
+        print("[!] No result, but the target is alive..")
+        drop_connection(self.host, self.port, self.vm_user)
+        self.rshell = None
+
+    def stage(self):
+        # Split from execute() so the next test case can be uploaded while the current one runs
+        patch = packed = None
         if self.lfile is not "" and pathlib.Path(self.lfile).exists():
-            self.cp_to_remote(self.lfile, self.rfile)
+            if self.agent and self.base:
+                patch = self.stage_delta()
+            if not patch:
+                packed = self.upload_full()
+        return patch, packed
+
+    def execute(self, patch=None, packed=None):
+        self.hangs = []
+        if self.agent:
+            return self._fuzz_agent(patch, packed)
         self._mount()
         if self._is_alive():
             if self.user_sim:
                 self._user_interaction()
-            else:
-                self._umount()
+            self._umount()
+            self.last_outcome = "hang" if self.hangs else "ok"
+            if self.hangs and self.vmctl:
+                self.recover()
         else:
-            # gotta reset vm
-            print("[!] Target is dead..")
+            self.last_outcome = "hang" if self.monitor.verdict == HANG else "crash"
+            self.recover()
+
+    def fuzz(self):
+        try:
+            staged = self.stage()
+        except CONNECTION_ERRORS as e:
+            logging.debug(f"Upload failed: {e}")
+            self.hangs = []
+            self._failed()
+            return None
+        return self.execute(*staged)
+
+    def user_ops(self):
+        return generate(self.workload_seed, self.workload_ops) if self.user_sim else None
+
+    def _print_workload(self, ops, rcs):
+        s = summary(ops, rcs)
+        failed = ", ".join(f"{k}={v}" for k, v in sorted(s["failed"].items()))
+        print(f"[*] workload {s['done']}/{s['ops']} ops{', failed: ' + failed if failed else ''}")
+        if s["done"] < s["ops"]:
+            print(f"[!] Stuck at op {s['done']}: {ops[s['done']]}")
 
     def _user_interaction(self):
-        # self._exec('find /mnt/HITB/')
-        # self._exec(
-        #    'mkdir -p /mnt/HITB/qNVzrx8xrw7hJ0e9sNynpSbICS5olJQmKQWNcZpX6L3foywr21FaqOWe6z6LnVxWeYUsR3PlIurBjLK5gaIoogjGoKQLNkV1e1/a/b/c')
-        # self._exec('cp /bin/ls /mnt/HITB/')
-        self._exec("/usr/bin/dirname /mnt/")
-        self._exec("bin/rm -rf /mnt/HITB/reFEk8zIzNNNdIHqWStDP2DXU4Em4xeIbujCvW3IoqkJFMc0VtHmZWAF3pjUGHGADqSGruv")
+        # the whole sequence is one /bin/sh invocation, one exit status per op comes back
+        ops = self.user_ops() or generate(self.workload_seed, self.workload_ops)
+        out = self._exec(f"/bin/sh -c {shlex.quote(to_script(ops, self.mount_at))}", op="workload")
+        rcs = parse_script(out) if isinstance(out, str) else []
+        self._print_workload(ops, rcs)
+        return rcs
 
     def poc(self, shell=False, emul=False):
         if self.lfile is not "" and pathlib.Path(self.lfile).exists():
@@ -218,7 +486,8 @@ class Fuzzer:
             if shell:
                 self.interactive_shell()
             elif emul:
-                self._user_interaction()
+                for cmd in POC_CMDS:
+                    self._exec(cmd)
             self._umount()
         else:
             return 1
@@ -234,6 +503,35 @@ def main():
     parser.add_argument(
         "--user_interaction", "-ui", action="store_true", help="Emulate a user interaction if mount is successful"
     )
+    parser.add_argument(
+        "--agent", "-a", action="store_true", help="Run the whole test case through the remote agent in one round trip"
+    )
+    parser.add_argument(
+        "--base", "-b", type=str, help="Seed the test case was mutated from, only its patch list is uploaded. Requires -a"
+    )
+    parser.add_argument(
+        "--compress",
+        "-z",
+        choices=["none", "zlib", "lzma"],
+        help="Pack full uploads sparse aware with this codec. Requires -a",
+    )
+    parser.add_argument("--level", "-l", type=int, default=6, help="Compression level. Default: %(default)s")
+    parser.add_argument("--domain", "-d", type=str, help="libvirt domain of the target, restored after a crash or hang")
+    parser.add_argument("--snapshot", "-s", type=str, help="Snapshot to restore, resets the domain if not given. Requires -d")
+    parser.add_argument(
+        "--probe_interval", "-pi", type=float, default=PROBE_INTERVAL, help="Liveness probe interval. Default: %(default)ss"
+    )
+    parser.add_argument(
+        "--probe_misses", "-pm", type=int, default=MISS_THRESHOLD, help="Missed probes until dead. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--workload_seed", "-ws", type=int, default=0, help="Seed of the -ui file system workload. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--workload_ops", "-wo", type=int, default=WORKLOAD_OPS, help="Operations per -ui workload. Default: %(default)s"
+    )
+    parser.add_argument("--kcov", "-k", action="store_true", help="Collect kernel coverage on the target. Requires -a")
+    parser.add_argument("--timeout_db", "-td", type=str, help="Keep the learned per operation timeouts in this json file")
     parser.add_argument("--copy_from", "-cf", nargs=2, help="remote -> local. Requires lpath and rpath")
     parser.add_argument("--copy_to", "-ct", nargs=2, help="local -> remote. Requires lpath and rpath")
     parser.add_argument("--poc_1", "-1", action="store_true", help="DEMO 1 - Default")
@@ -271,6 +569,7 @@ def main():
     if args.copy_to:
         pass
     if all([args.host, args.port, args.file, args.file_type, args.remote_mount_point]):
+        timeouts = TimeoutTracker(path=args.timeout_db) if args.timeout_db else None
         Fuzzer(
             host=args.host,
             port=args.port,
@@ -278,7 +577,20 @@ def main():
             ft=args.file_type,
             mntpt=args.remote_mount_point,
             user_sim=args.user_interaction,
+            agent=args.agent,
+            base=args.base,
+            compress=args.compress,
+            level=args.level,
+            vmctl=VirshControl(args.domain, snapshot=args.snapshot, host=args.host, port=args.port) if args.domain else None,
+            probe_interval=args.probe_interval,
+            probe_misses=args.probe_misses,
+            timeouts=timeouts,
+            kcov=args.kcov,
+            workload_seed=args.workload_seed,
+            workload_ops=args.workload_ops,
         ).fuzz()
+        if timeouts:
+            timeouts.save()
 
 
 if __name__ == "__main__":
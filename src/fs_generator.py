@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import argparse
+import itertools
 import json
 import logging
 import os
@@ -9,11 +10,32 @@ import random
 import string
 import subprocess
 import sys
+import time
 import uuid
-from shutil import rmtree
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from shutil import copyfile, rmtree
+from typing import List, Optional
 
 CHARSET_EASY = string.ascii_letters + string.digits  # excluding special characters due to parsing difficulties
+CONTENT_MODES = ["random", "pattern", "compressible"]
+CHUNK_SIZE = 1 << 20  # file data is generated and written in chunks of this size
+PAGE_SIZE = 4096
+MAX_VND = 16  # vnd(4) units tried on OpenBSD/NetBSD
+
+# Tunable population profiles, every value can be overridden with --profile_opt key=value
+POPULATION_PROFILES = {
+    # random mix of entries, the weights reproduce the original coin toss
+    "uniform": {"file": 4, "dir": 2, "symlink": 1, "hardlink": 1, "name_min": 1, "name_max": 255},
+    # a single directory with a huge amount of entries (dirhash, htree)
+    "wide_dir": {"entries": 100000, "dir_ratio": 0.1, "name_min": 8, "name_max": 64},
+    # deep directory chains with a few files on every level
+    "deep_tree": {"depth": 30, "trees": 4, "files_per_level": 2, "name_min": 1, "name_max": 24},
+    # files grown in small interleaved appends so their blocks end up scattered, then every n-th file is deleted again
+    "fragmented": {"files": 64, "chunk": 4096, "rounds": 0, "delete_every": 3},
+    # one inode with thousands of hard links spread over a few directories
+    "hardlink_farm": {"links": 5000, "dirs": 16, "name_min": 8, "name_max": 32},
+}
 
 SUPPORTED_FILE_SYSTEMS = {
     "freebsd": ["ufs1", "ufs2", "zfs", "ext2", "ext3", "ext4"],
@@ -52,6 +74,242 @@ def _chk_availability(cmd: str):
     return not subprocess.call(["which", f"{cmd}"], stdout=subprocess.DEVNULL)
 
 
+def _rnd_bytes(rng: random.Random, n: int):
+    if hasattr(rng, "randbytes"):
+        return rng.randbytes(n)
+    return rng.getrandbits(n * 8).to_bytes(n, "little")
+
+
+def _gen_content(seed, size: int, mode="random", chunk_size=CHUNK_SIZE):
+    # Yields the file data for one entry chunk by chunk, fully determined by the entry seed
+    rng = random.Random(seed)
+    if mode == "pattern":
+        pattern = _rnd_bytes(rng, rng.randint(1, 64))
+        block = pattern * (chunk_size // len(pattern) + 2)
+    off = 0
+    while size > 0:
+        n = min(chunk_size, size)
+        if mode == "pattern":
+            phase = off % len(pattern)
+            chunk = block[phase : phase + n]
+        elif mode == "compressible":
+            # a quarter of every page is random, the rest is zero filled
+            pages = -(-n // PAGE_SIZE)
+            chunk = b"".join(_rnd_bytes(rng, PAGE_SIZE >> 2) + bytes(PAGE_SIZE - (PAGE_SIZE >> 2)) for _ in range(pages))[:n]
+        else:
+            chunk = _rnd_bytes(rng, n)
+        size -= n
+        off += n
+        yield chunk
+
+
+def _rnd_name(rng: random.Random, lo: int, hi: int):
+    return "".join(rng.choices(CHARSET_EASY, k=rng.randint(lo, hi)))
+
+
+def _get_profile_opts(profile: str, overrides=None):
+    if profile not in POPULATION_PROFILES:
+        raise GeneratorError(f"Unknown population profile: {profile}")
+    opts = dict(POPULATION_PROFILES[profile])
+    for k, v in (overrides or {}).items():
+        if k not in opts:
+            raise GeneratorError(f"Unknown option '{k}' for population profile {profile}")
+        try:
+            opts[k] = type(opts[k])(v)
+        except ValueError:
+            raise GeneratorError(f"Option '{k}' of population profile {profile} must be {type(opts[k]).__name__}, got '{v}'")
+        if opts[k] < 0:
+            raise GeneratorError(f"Option '{k}' of population profile {profile} must not be negative")
+    if profile == "uniform" and not any(opts[k] for k in ["file", "dir", "symlink", "hardlink"]):
+        raise GeneratorError("Population profile uniform needs at least one weight > 0")
+    return opts
+
+
+def _chk_fs_args(fs_type: str, size: int, n_files=None, max_fsize=None):
+    # size in MB, max_fsize in KB as given on the command line
+    if size < 64 and fs_type == "zfs":
+        return "ZFS needs at least 64MB of disk size"
+    if size < 2 and fs_type == "ext3":
+        return "EXT3 needs at least 2MB of disk size"
+    if (n_files and not max_fsize) or (max_fsize and not n_files):
+        return "-p and -ps depend on each other. Set both or neither of them!"
+    if n_files and max_fsize and (n_files * (max_fsize << 10) > size << 20):
+        return "New file system does not hold enough free space to write all requested files!"
+    return None
+
+
+def _expand_batch_matrix(matrix: dict, default_out: str, mount_pt: str, default_content="random", default_profile="uniform"):
+    # Cartesian product over all lists, except 'output_dir' which is assigned round-robin to spread the I/O over disks
+    out_dirs = matrix.get("output_dir", [default_out])
+    if isinstance(out_dirs, str):
+        out_dirs = [out_dirs]
+    jobs = []
+    for i, (fs, size, n_files, max_fsize, seed, content, profile) in enumerate(
+        itertools.product(
+            matrix["filesystem"],
+            matrix["size"],
+            matrix.get("populate", [None]),
+            matrix.get("populate_size", [None]),
+            matrix.get("seed", [None]),
+            matrix.get("content", [default_content]),
+            matrix.get("profile", [default_profile]),
+        )
+    ):
+        name = f"{fs}_{size}mb"
+        if n_files and max_fsize:
+            name += f"_p{n_files}_ps{max_fsize}_{content}_{profile}"
+        name += f"_s{seed}" if seed is not None else f"_{i}"
+        out_dir = out_dirs[i % len(out_dirs)]
+        jobs.append(
+            GeneratorConfig(
+                fs_type=str(fs).lower(),
+                fs_size=int(size),
+                fs_name=name,
+                n_files=n_files,
+                max_fsize=max_fsize,
+                save_pt=out_dir,
+                mount_pt=mount_pt,
+                seed=seed,
+                content=content,
+                profile=profile,
+                profile_opts=matrix.get("profile_opts", {}).get(profile),
+                log_path=os.path.join(out_dir, name + ".json"),
+            )
+        )
+    return jobs
+
+
+def _get_shaper_fsize(log_data: dict):
+    # Older logs only carry the truncated MB value
+    if "max_file_size (KB)" in log_data:
+        return int(log_data["max_file_size (KB)"])
+    return int(log_data["max_file_size (MB)"]) << 10
+
+
+def _shaper_jobs(log_data: dict, sizes: List, mount_pt: str, content_cache: str):
+    jobs = []
+    for size in sizes:
+        name = f"SHP_{size}__" + log_data["fs_name"]
+        jobs.append(
+            GeneratorConfig(
+                fs_type=str(log_data["fs_type"]).lower(),
+                fs_size=int(size),
+                fs_name=name,
+                n_files=int(log_data["amount_files"]),
+                max_fsize=_get_shaper_fsize(log_data),
+                save_pt=str(log_data["save_at"]),
+                mount_pt=mount_pt,
+                content=log_data.get("content_mode", "random"),
+                profile=log_data.get("profile", {}).get("name", "uniform"),
+                profile_opts=log_data.get("profile", {}).get("opts"),
+                data=log_data,
+                content_cache=content_cache,
+                log_path=os.path.join(str(log_data["save_at"]), name + ".json"),
+            )
+        )
+    return jobs
+
+
+def _fill_content_cache(log_data: dict, cache_dir: str):
+    # Every logged data file is generated exactly once, the shaped variants only copy it over
+    _mk_dir(cache_dir)
+    mode = log_data.get("content_mode", "random")
+    for key, entry in log_data["files"].items():
+        if key.startswith("seed_") and entry.get("file_type") == "FILE" and entry.get("seed_value") is not None:
+            with open(os.path.join(cache_dir, key), "wb") as f:
+                for chunk in _gen_content(entry["seed_value"], entry["file_size"], mode):
+                    f.write(chunk)
+
+
+class GeneratorError(Exception):
+    pass
+
+
+@dataclass
+class GeneratorConfig:
+    # Same units as on the command line: fs_size in MB, max_fsize in KB
+    fs_type: str
+    fs_size: int
+    fs_name: Optional[str] = None
+    n_files: Optional[int] = None
+    max_fsize: Optional[int] = None
+    save_pt: str = "/tmp/"
+    mount_pt: str = "/mnt/"
+    mode: int = 1
+    seed: Optional[int] = None
+    content: str = "random"
+    profile: str = "uniform"
+    profile_opts: Optional[dict] = None
+    data: Optional[dict] = None  # json log of an earlier run to reshape
+    content_cache: Optional[str] = None
+    log_path: Optional[str] = None  # the json log is only returned in GeneratorResult.log if unset
+
+
+@dataclass
+class GeneratorResult:
+    path: str
+    fs_name: str
+    log: dict
+    timings: dict = field(default_factory=dict)
+
+
+def generate(cfg: GeneratorConfig) -> GeneratorResult:
+    err = _chk_fs_args(cfg.fs_type, cfg.fs_size, cfg.n_files, cfg.max_fsize)
+    if err:
+        raise GeneratorError(err)
+    if cfg.content not in CONTENT_MODES:
+        raise GeneratorError(f"Unknown content mode: {cfg.content}")
+    profile_opts = _get_profile_opts(cfg.profile, cfg.profile_opts)
+    _mk_dir(cfg.save_pt)
+    _mk_dir(cfg.mount_pt)
+    creator = GenericFilesystemCreator()
+    creator.__setup__(
+        fs_name=cfg.fs_name,
+        fs_type=cfg.fs_type.lower(),
+        fs_size=cfg.fs_size << 20,
+        n_files=cfg.n_files,
+        max_fsize=cfg.max_fsize << 10 if cfg.max_fsize else None,
+        mount_pt=cfg.mount_pt,
+        save_pt=cfg.save_pt,
+        mode=cfg.mode,
+        data=cfg.data,
+        master_seed=cfg.seed,
+        content_mode=cfg.content,
+        content_cache=cfg.content_cache,
+        profile=cfg.profile,
+        profile_opts=profile_opts,
+        log_path=cfg.log_path,
+    )
+    creator.build()
+    return GeneratorResult(path=creator.path, fs_name=creator.fs_name, log=creator.logger, timings=creator.timings)
+
+
+def _attach_vnd(vnconfig: str, path: str):
+    # Configuring a busy unit fails, so trying the units in order gives every parallel batch worker its own device
+    for unit in range(MAX_VND):
+        dev = f"vnd{unit}"
+        if subprocess.call([vnconfig, dev, path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0:
+            return dev
+    raise GeneratorError(f"No free vnd device for {path}")
+
+
+def mk_batch(jobs: List[GeneratorConfig], workers=None):
+    # Every job gets its own block device, mount point (mount_pt/fs_name) and json log
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                res = future.result()
+                print(f"[+] Created {res.path} in {res.timings['total']:.2f}s")
+            except (Exception, SystemExit) as e:
+                failed += 1
+                print(f"[!] Failed to create {job.fs_name}: {e!r}")
+    print(f"[*] Batch done: {len(jobs) - failed}/{len(jobs)} images created.")
+    return failed
+
+
 class GenericFilesystemCreator:
     def __init__(self):
         self.fs_name = None
@@ -66,8 +324,21 @@ class GenericFilesystemCreator:
         self.logger = {}
         self.mode = None
         self.rng = random.Random()  # Class bound number generator
+        self.master_seed = None
+        self.content_mode = "random"
+        self.content_cache = None
+        self.profile = "uniform"
+        self.profile_opts = dict(POPULATION_PROFILES["uniform"])
         self.host = platform.system().lower()
         self.data = None
+        self.dev = None
+        self.mounted = False
+        self.read_only = False
+        self.log_path = None
+        self.timings = {}
+        self.config = None
+        self.batch_jobs = None
+        self.workers = None
 
     def __setup__(self, **kwargs):
         if "fs_name" in kwargs:
@@ -88,15 +359,39 @@ class GenericFilesystemCreator:
             self.mode = kwargs["mode"]
         if "data" in kwargs:
             self.data = kwargs["data"]
+        if "master_seed" in kwargs:
+            self.master_seed = kwargs["master_seed"]
+        if "log_path" in kwargs:
+            self.log_path = kwargs["log_path"]
+        if "content_mode" in kwargs:
+            self.content_mode = kwargs["content_mode"]
+        if "content_cache" in kwargs:
+            self.content_cache = kwargs["content_cache"]
+        if "profile" in kwargs:
+            self.profile = kwargs["profile"]
+        if "profile_opts" in kwargs:
+            self.profile_opts = kwargs["profile_opts"]
 
     def mk_file_system(self):
         self._parse_opts()
+        if self.batch_jobs:
+            try:
+                if self.content_cache:
+                    _fill_content_cache(self.data, self.content_cache)
+                return mk_batch(self.batch_jobs, self.workers)
+            finally:
+                if self.content_cache:
+                    rmtree(self.content_cache, ignore_errors=True)
+        return generate(self.config)
+
+    def build(self):
         if not any(x == self.fs_type for x in SUPPORTED_FILE_SYSTEMS[self.host]):
-            logging.error(f"Requested file system not supported on current host os: {self.host}")
-            sys.exit(1)
+            raise GeneratorError(f"Requested file system not supported on current host os: {self.host}")
+        start = time.perf_counter()
         self._init_mk_fs()
         host = self._set_target()
         self._create_fs(host)
+        self.timings["total"] = time.perf_counter() - start
 
     def _set_target(self):
         target = None
@@ -123,18 +418,32 @@ class GenericFilesystemCreator:
         )
 
     def _create_fs(self, target):
-        target.mk_fs()
-        if self.n_files and self.max_fsize:
-            self._logger_setup()
-            self._mount(target)
-            self._init_fs_dummy_data()
-            self._populate_fs()
-            target.unmount_fs()
-            rmtree(self.mount_pt)
-        else:
-            print(f"Created empty {self.fs_type} disk: {self.path} {self.fs_name}")
-            if target.fs_type == "zfs":
-                target.unmount_fs()
+        mounted_at = None
+        try:
+            start = time.perf_counter()
+            target.mk_fs()
+            self.timings["mk_fs"] = time.perf_counter() - start
+            if self.n_files and self.max_fsize and not target.read_only:
+                start = time.perf_counter()
+                self._logger_setup()
+                mounted_at = self._mount(target)
+                if self.master_seed is not None:
+                    self.rng.seed(self.master_seed)
+                self._init_fs_dummy_data()
+                if self.profile == "uniform":
+                    self._populate_fs()
+                else:
+                    self._populate_profile()
+                self.timings["populate"] = time.perf_counter() - start
+            else:
+                logging.info(f"Created empty {self.fs_type} disk: {self.path} {self.fs_name}")
+        finally:
+            # Loop device and mount have to go away no matter what, otherwise parallel batch runs leak them
+            start = time.perf_counter()
+            target.release()
+            if mounted_at:
+                rmtree(mounted_at, ignore_errors=True)
+            self.timings["release"] = time.perf_counter() - start
 
     def _mount(self, target):
         if self.fs_type != "zfs":
@@ -142,6 +451,19 @@ class GenericFilesystemCreator:
             self.mount_pt = target.mount_pt
             logging.info("Mounting...")
             target.mount_fs()
+            target.mounted = True
+            return target.mount_pt
+        return None
+
+    def release(self):
+        if not self.dev:
+            return
+        if self.mounted or self.fs_type == "zfs":
+            self.unmount_fs()
+        else:
+            self._unmk_blk_dev()
+        self.mounted = False
+        self.dev = None
 
     @staticmethod
     def generic_mount(flag, dev, location):
@@ -156,17 +478,16 @@ class GenericFilesystemCreator:
     @staticmethod
     def _generic_mk_zfs(name, dev):
         if not _chk_availability("zpool"):
-            logging.error("Could not find zfs utils.")
-            logging.error("Please install the appropriate tooling: e.g.: zfsutils-linux on Debian.")
-            sys.exit(1)
+            raise GeneratorError(
+                "Could not find zfs utils. Please install the appropriate tooling: e.g.: zfsutils-linux on Debian."
+            )
         try:
             subprocess.call(f"zpool create {name} {dev}".split())
             subprocess.call(f"zfs set mountpoint=/mnt/{name} {name}".split())
             subprocess.call(f"zfs set atime=off {name}".split())
             return os.path.join("/mnt", name)
         except subprocess.CalledProcessError:
-            logging.error("Failed in genericMakeZFS routine!")
-            sys.exit(1)
+            raise GeneratorError("Failed in genericMakeZFS routine!")
 
     def _init_mk_fs(self):
         if not self.fs_name:
@@ -188,11 +509,15 @@ class GenericFilesystemCreator:
             else:
                 self._set_seed()
             self._set_logger_seed(f_ctr)
-            coin_toss = self.rng.randint(0, 7)
+            coin_toss = self.rng.randint(0, sum(self.profile_opts[k] for k in ["file", "dir", "symlink", "hardlink"]) - 1)
             all_dirs = _get_all_dirs(self.mount_pt)
             self._create_files(all_dirs, coin_toss, f_ctr)
             self._hierarchy_sanity_check(f_ctr)
-        print(json.dumps(self.logger, separators=(",", ":"), indent=4))
+        self._dump_log()
+
+    def _dump_log(self):
+        if self.log_path:
+            pathlib.Path(self.log_path).write_text(json.dumps(self.logger, separators=(",", ":"), indent=4))
 
     def _hierarchy_sanity_check(self, f_ctr):
         if self.data and self.logger["files"][f"seed_{f_ctr}"]["file_name"] != self.data["files"][f"seed_{f_ctr}"]["file_name"]:
@@ -207,17 +532,108 @@ class GenericFilesystemCreator:
         print(f"Got: {_actual}")
 
     def _create_files(self, all_dirs, coin_toss, fctr):
-        if coin_toss in range(0, 4):
+        n_file = self.profile_opts["file"]
+        n_dir = n_file + self.profile_opts["dir"]
+        n_sym = n_dir + self.profile_opts["symlink"]
+        if coin_toss < n_file:
             self._create_data_file(self._get_new_rndm_file_path(all_dirs), fctr)
-        if coin_toss in range(4, 6):
+        elif coin_toss < n_dir:
             self._create_dir(self._get_new_rndm_file_path(all_dirs), fctr)
-        if coin_toss == 6:
+        elif coin_toss < n_sym:
             all_files = _get_all_files(self.mount_pt)
             self._create_new_link(all_files, all_dirs, fctr, "SYM_LINK")
-        if coin_toss == 7:
+        else:
             all_data_files = _get_all_data_files(self.mount_pt)
             self._create_new_link(all_data_files, all_dirs, fctr, "HARD_LINK")
 
+    def _populate_profile(self):
+        # Stress profiles keep their own bookkeeping instead of walking the whole tree for every new entry
+        if self.data:
+            p_seed = self.data["profile"]["seed"]
+        elif self.master_seed is not None:
+            p_seed = self.master_seed
+        else:
+            p_seed = random.getrandbits(64)
+        self.logger["profile"]["seed"] = p_seed
+        prng = random.Random(p_seed)
+        try:
+            getattr(self, f"_profile_{self.profile}")(prng, self.profile_opts)
+        except OSError as e:
+            # running out of inodes, blocks or links is expected when stressing the limits
+            logging.debug(f"Profile {self.profile} stopped early: {e}")
+            self.logger["profile"]["stopped"] = str(e)
+        self._dump_log()
+
+    def _profile_created(self, kind: str, n=1):
+        created = self.logger["profile"]["created"]
+        created[kind] = created.get(kind, 0) + n
+
+    def _profile_wide_dir(self, prng: random.Random, opts: dict):
+        root = os.path.join(self.mount_pt, _rnd_name(prng, opts["name_min"], opts["name_max"]))
+        os.mkdir(root)
+        for i in range(opts["entries"]):
+            # the hex counter keeps the names unique without having to remember them
+            name = (f"{i:x}_" + _rnd_name(prng, opts["name_min"], opts["name_max"]))[:255]
+            if prng.random() < opts["dir_ratio"]:
+                os.mkdir(os.path.join(root, name))
+                self._profile_created("DIR")
+            else:
+                os.close(os.open(os.path.join(root, name), os.O_CREAT | os.O_WRONLY, 0o644))
+                self._profile_created("FILE")
+
+    def _profile_deep_tree(self, prng: random.Random, opts: dict):
+        for _ in range(opts["trees"]):
+            cur = self.mount_pt
+            for _ in range(opts["depth"]):
+                cur = os.path.join(cur, _rnd_name(prng, opts["name_min"], opts["name_max"]))
+                os.mkdir(cur)
+                self._profile_created("DIR")
+                for _ in range(opts["files_per_level"]):
+                    fsize = prng.randrange(0, min(self.max_fsize, PAGE_SIZE) + 1)
+                    with open(os.path.join(cur, f"f_{_rnd_name(prng, opts['name_min'], opts['name_max'])}"), "wb") as f:
+                        for chunk in _gen_content(prng.getrandbits(64), fsize, self.content_mode):
+                            f.write(chunk)
+                    self._profile_created("FILE")
+
+    def _profile_fragmented(self, prng: random.Random, opts: dict):
+        root = os.path.join(self.mount_pt, "frag")
+        os.mkdir(root)
+        rounds = opts["rounds"] or max(1, self.max_fsize // opts["chunk"])
+        files = [os.path.join(root, f"frag_{i}") for i in range(opts["files"])]
+        fds = [os.open(f, os.O_CREAT | os.O_WRONLY | os.O_APPEND, 0o644) for f in files]
+        try:
+            for _ in range(rounds):
+                for fd in fds:
+                    for chunk in _gen_content(prng.getrandbits(64), opts["chunk"], self.content_mode):
+                        os.write(fd, chunk)
+                # flushing every round forces the allocator to interleave the blocks of all files
+                for fd in fds:
+                    os.fsync(fd)
+                self._profile_created("CHUNK", len(fds))
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self._profile_created("FILE", len(files))
+        if opts["delete_every"]:
+            for f in files[:: opts["delete_every"]]:
+                os.unlink(f)
+                self._profile_created("DELETED")
+
+    def _profile_hardlink_farm(self, prng: random.Random, opts: dict):
+        src = os.path.join(self.mount_pt, "farm_src")
+        with open(src, "wb") as f:
+            for chunk in _gen_content(prng.getrandbits(64), self.max_fsize, self.content_mode):
+                f.write(chunk)
+        self._profile_created("FILE")
+        dirs = []
+        for _ in range(opts["dirs"]):
+            dirs.append(os.path.join(self.mount_pt, _rnd_name(prng, opts["name_min"], opts["name_max"])))
+            os.mkdir(dirs[-1])
+            self._profile_created("DIR")
+        for i in range(opts["links"]):
+            os.link(src, os.path.join(prng.choice(dirs), f"{i:x}_" + _rnd_name(prng, opts["name_min"], opts["name_max"])))
+            self._profile_created("HARD_LINK")
+
     def _logger_setup(self):
         self.logger["fs_name"] = self.fs_name
         self.logger["fs_type"] = self.fs_type
@@ -225,6 +641,11 @@ class GenericFilesystemCreator:
         self.logger["fs_size (MB)"] = str(int(self.fs_size) >> 20)
         self.logger["amount_files"] = self.n_files
         self.logger["max_file_size (MB)"] = str(int(self.max_fsize) >> 20)
+        self.logger["max_file_size (KB)"] = str(int(self.max_fsize) >> 10)
+        if self.master_seed is not None:
+            self.logger["master_seed"] = self.master_seed
+        self.logger["content_mode"] = self.content_mode
+        self.logger["profile"] = {"name": self.profile, "opts": self.profile_opts, "created": {}}
         self.logger["files"] = {}
         self.logger["files"]["init_files"] = {}
 
@@ -250,10 +671,12 @@ class GenericFilesystemCreator:
 
     def _get_new_rndm_file_path(self, dirs: List):
         self.rng.seed(self.seed)
-        return os.path.join(self._get_rndm_path_from_lst(dirs), self._get_rndm_fname())
+        return os.path.join(
+            self._get_rndm_path_from_lst(dirs), self._get_rndm_fname(self.profile_opts["name_min"], self.profile_opts["name_max"])
+        )
 
-    def _get_rndm_fname(self):
-        n_len = self.rng.randint(1, 255)
+    def _get_rndm_fname(self, lo=1, hi=255):
+        n_len = self.rng.randint(lo, hi)
         return self._get_rndm_str(size=n_len)
 
     def _create_new_link(self, files: List, dirs: List, ctr: int, ftype: str):
@@ -279,10 +702,16 @@ class GenericFilesystemCreator:
 
     def _create_data_file(self, location: str, ctr: int):
         try:
-            fsize = self.rng.randrange(0.25 * self.max_fsize, self.max_fsize, 50)
+            fsize = self.rng.randrange(int(0.25 * self.max_fsize), self.max_fsize, 50)
             self._set_logger_generic(ctr, location)
             self._set_logger_specific(ctr, ftype="FILE", fsize=fsize)
-            pathlib.Path(location).write_bytes(os.urandom(fsize))
+            cached = os.path.join(self.content_cache, f"seed_{ctr}") if self.content_cache else None
+            if cached and os.path.isfile(cached) and os.path.getsize(cached) == fsize:
+                copyfile(cached, location)
+                return
+            with open(location, "wb") as f:
+                for chunk in _gen_content(self.seed, fsize, self.content_mode):
+                    f.write(chunk)
         except OSError:
             pass
 
@@ -310,7 +739,7 @@ class GenericFilesystemCreator:
 
     def _set_seed(self):
         if self.mode:
-            self.seed = self.rng.getrandbits(random.randint(1, 1024))
+            self.seed = self.rng.getrandbits(self.rng.randint(1, 1024))
         else:
             self.seed = None
         self.rng.seed(self.seed)
@@ -348,7 +777,7 @@ class GenericFilesystemCreator:
         _actual = self.logger["files"]["init_files"][f"init_{ctr}"]["name"]
         print(f" Expected: {_expected}")
         print(f" Got: {_actual}")
-        sys.exit(1)
+        raise GeneratorError(f"Shaper could not reproduce init_{ctr}")
 
     def _set_logger_dummy_data(self, name: str, _path: str, i: int, ftype: str):
         self.logger["files"]["init_files"][f"init_{i}"] = {}
@@ -407,60 +836,99 @@ class GenericFilesystemCreator:
             "-shp",
             "--shaper",
             action="append",
-            nargs=2,
+            nargs="+",
+            metavar=("LOG", "SIZE"),
             help="Requires a valid json log file from the file system creation process and "
             "the desired new file system size to reshape the create a new file system "
-            "with the same layout but of the new size!",
+            "with the same layout but of the new size! Multiple sizes are built in parallel",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Master seed for the populating phase, makes the whole hierarchy reproducible",
+        )
+        parser.add_argument(
+            "-c",
+            "--content",
+            type=str,
+            default="random",
+            choices=CONTENT_MODES,
+            help="File data generated from the per file seed, (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-pr",
+            "--profile",
+            type=str,
+            default="uniform",
+            choices=list(POPULATION_PROFILES),
+            help="Population profile for -p, every profile but 'uniform' ignores the -p count, (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-po",
+            "--profile_opt",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            help="Override a value of the selected population profile, e.g. entries=20000",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch",
+            type=str,
+            help="JSON matrix with lists for 'filesystem', 'size' and optionally 'populate', 'populate_size', 'seed' and "
+            "'output_dir'. Every combination is created in parallel",
+        )
+        parser.add_argument(
+            "-w", "--workers", type=int, default=os.cpu_count(), help="Worker processes for --batch, (default: %(default)s)",
         )
         args = parser.parse_args()
+        if args.batch:
+            matrix = json.loads(pathlib.Path(args.batch).read_text())
+            if "filesystem" not in matrix or "size" not in matrix:
+                parser.error("Batch matrix needs at least a 'filesystem' and a 'size' list")
+            self.batch_jobs = _expand_batch_matrix(matrix, args.output_dir, args.mount, args.content, args.profile)
+            self.workers = args.workers
+            return
         if args.shaper:
+            if len(args.shaper[0]) < 2:
+                parser.error("-shp needs a log file and at least one size")
             log_data = json.loads(pathlib.Path(args.shaper[0][0]).read_text())
+            if len(args.shaper[0]) > 2:
+                self.content_cache = os.path.join(str(log_data["save_at"]), f".shp_cache_{log_data['fs_name']}")
+                self.batch_jobs = _shaper_jobs(log_data, args.shaper[0][1:], args.mount, self.content_cache)
+                self.data = log_data
+                self.workers = args.workers
+                return
             args.name = f"SHP_{args.shaper[0][1]}__" + log_data["fs_name"]
             args.filesystem = str(log_data["fs_type"])
             args.size = int(args.shaper[0][1])
             args.populate = int(log_data["amount_files"])
-            args.populate_size = int(log_data["max_file_size (MB)"]) << 10
+            args.populate_size = _get_shaper_fsize(log_data)
             args.mode = 1
             args.output_dir = str(log_data["save_at"])
+            args.content = log_data.get("content_mode", "random")
+            args.profile = log_data.get("profile", {}).get("name", "uniform")
+            args.profile_opt = [f"{k}={v}" for k, v in log_data.get("profile", {}).get("opts", {}).items()]
         if not args.size or not args.filesystem:
             parser.print_help()
             sys.exit(1)
-        if args.size < 64 and args.filesystem == "zfs":
-            parser.error("ZFS needs at least 64MB of disk size")
-            sys.exit(1)
-        elif args.size < 2 and args.filesystem == "ext3":
-            parser.error("EXT3 needs at least 2MB of disk size")
-            sys.exit(1)
-        if (args.populate and not args.populate_size) or (args.populate_size and not args.populate):
-            parser.error("-p and -ps depend on each other. Set both or neither of them!")
-            sys.exit(1)
-        elif args.populate_size and args.populate:
-            args.populate_size = args.populate_size << 10  # shift bytes into Megabytes
-        args.size = args.size << 20
-        if args.populate and args.populate_size and (args.populate * args.populate_size > args.size):
-            parser.error("New file system does not hold enough free space to write all requested files!")
-            sys.exit(1)
-        if args.output_dir:
-            _mk_dir(args.output_dir)
-        else:
-            _mk_dir(self.save_pt)
-        if args.mount:
-            _mk_dir(args.mount)
-        else:
-            _mk_dir(self.mount_pt)
-        if args.mode is 1:
-            self.mode = 1
-        else:
-            self.mode = 0
+        err = _chk_fs_args(args.filesystem, args.size, args.populate, args.populate_size)
+        if err:
+            parser.error(err)
+        if any("=" not in o for o in args.profile_opt):
+            parser.error("--profile_opt expects KEY=VALUE")
 
-        self.__setup__(
-            fs_name=args.name,
+        self.config = GeneratorConfig(
             fs_type=str(args.filesystem).lower(),
             fs_size=args.size,
+            fs_name=args.name,
             n_files=args.populate,
             max_fsize=args.populate_size,
-            mode=args.mode,
-            save_pt=args.output_dir,
+            save_pt=args.output_dir or self.save_pt,
+            mount_pt=args.mount or self.mount_pt,
+            mode=1 if args.mode == 1 else 0,
+            seed=args.seed,
+            content=args.content,
+            profile=args.profile,
+            profile_opts=dict(o.split("=", 1) for o in args.profile_opt),
             data=log_data,
         )
 
@@ -495,6 +963,9 @@ class Darwin(GenericFilesystemCreator):
     def _detach_disk(self):
         subprocess.call(f"/usr/bin/hdiutil detach {self.dev}".split(), stdout=subprocess.DEVNULL)
 
+    def _unmk_blk_dev(self):
+        self._detach_disk()
+
     def mk_fs(self):
         if self.fs_type == "apfs":
             self._mk_apfs()
@@ -511,11 +982,9 @@ class Darwin(GenericFilesystemCreator):
                 f"/sbin/mount_{self.fs_type} {self.dev} {self.mount_pt}".split(), stdout=subprocess.DEVNULL,
             )
         except subprocess.CalledProcessError:
-            logging.error(f"Failed to mount {self.fs_name} during populating phase")
-            sys.exit(1)
+            raise GeneratorError(f"Failed to mount {self.fs_name} during populating phase")
         except RuntimeError as e:
-            logging.error(e)
-            sys.exit(1)
+            raise GeneratorError(e)
         finally:
             self._detach_disk()
 
@@ -552,8 +1021,8 @@ class Ubuntu(GenericFilesystemCreator):
         self.save_pt = save_pt
 
     def _mk_blk_dev(self):
-        self.dev = subprocess.check_output("losetup -f".split(), encoding="utf-8").strip()
-        subprocess.check_output(f"losetup {self.dev} {self.path}".split(), encoding="utf-8").strip()
+        # find and attach in one go, a separate "losetup -f" races with other batch workers
+        self.dev = subprocess.check_output(f"losetup -f --show {self.path}".split(), encoding="utf-8").strip()
         logging.debug(f"block device {self.dev} created")
         return self.dev
 
@@ -572,12 +1041,10 @@ class Ubuntu(GenericFilesystemCreator):
 
     def _mk_ufs(self):
         if not _chk_availability("mkfs.ufs"):
-            logging.error("Could not find mkfs.ufs")
-            logging.error(
-                "Please install legacy package from:"
+            raise GeneratorError(
+                "Could not find mkfs.ufs. Please install legacy package from:"
                 "\thttps://mirrors.mediatemple.net/debian-archive/debian/pool/main/u/ufsutils/ufsutils_8.2-3_amd64.deb"
             )
-            sys.exit(1)
         if self.fs_type == "ufs1":
             flag = 1
         else:
@@ -588,7 +1055,7 @@ class Ubuntu(GenericFilesystemCreator):
         print(
             f"[*] The Ubuntu kernel has by default no write permissions for UFS.\n\tEmpty file system '{self.fs_name}' created."
         )
-        sys.exit(0)
+        self.read_only = True
 
     def _mk_ext(self):
         subprocess.call(
@@ -606,13 +1073,9 @@ class Ubuntu(GenericFilesystemCreator):
                 f"/bin/mount -t {self.fs_type} {self.dev} {self.mount_pt}".split(), stdout=subprocess.DEVNULL,
             )
         except subprocess.CalledProcessError:
-            logging.error(f"Failed to mount {self.fs_name} during populating phase")
-            self._unmk_blk_dev()
-            sys.exit(1)
+            raise GeneratorError(f"Failed to mount {self.fs_name} during populating phase")
         except RuntimeError as e:
-            logging.error(e)
-            self._unmk_blk_dev()
-            sys.exit(1)
+            raise GeneratorError(e)
 
     def unmount_fs(self):
         if self.fs_type in ["ext2", "ext3", "ext4"]:
@@ -634,8 +1097,7 @@ class Ubuntu(GenericFilesystemCreator):
             subprocess.call(cmd_export_pool.split(), stdout=subprocess.DEVNULL)
             self._unmk_blk_dev()
         except RuntimeError as e:
-            logging.warning(e)
-            sys.exit(1)
+            raise GeneratorError(e)
 
 
 #######################################################################################################################
@@ -703,9 +1165,7 @@ class FreeBSD(GenericFilesystemCreator):
         elif "ufs" in self.fs_type:
             flag = "ufs"
         if not GenericFilesystemCreator.generic_mount(flag, self.dev, self.mount_pt):
-            self._unmk_blk_dev()
-            logging.error(f"Failed to mount {self.fs_name} during populating phase")
-            sys.exit(1)
+            raise GeneratorError(f"Failed to mount {self.fs_name} during populating phase")
 
     def unmount_fs(self):
         if self.fs_type in ["ext2", "ext3", "ext4", "ufs1", "ufs2"]:
@@ -727,8 +1187,7 @@ class FreeBSD(GenericFilesystemCreator):
             subprocess.call(cmd_export_pool.split(), stdout=subprocess.DEVNULL)
             self._unmk_blk_dev()
         except RuntimeError as e:
-            logging.warning(e)
-            sys.exit(1)
+            raise GeneratorError(e)
 
 
 #######################################################################################################################
@@ -736,7 +1195,7 @@ class FreeBSD(GenericFilesystemCreator):
 #######################################################################################################################
 
 
-class OpenBSD:
+class OpenBSD(GenericFilesystemCreator):
     def __init__(self, fs, size, name, location, mount_pt, n_files, max_fsize, mode, save_pt):
         super(OpenBSD, self).__init__()
         self.fs_type = fs
@@ -751,9 +1210,11 @@ class OpenBSD:
         self.save_pt = save_pt
 
     def _mk_blk_dev(self):
-        subprocess.check_output(f"/sbin/vnconfig vnd0 {self.path}".split(), stderr=subprocess.STDOUT, encoding="utf-8",).strip()
+        vnd = _attach_vnd("/sbin/vnconfig", self.path)
         self.dev = (
-            subprocess.check_output("/sbin/disklabel -A vnd0", stderr=subprocess.STDOUT, encoding="utf-8").split()[1][:-1].strip()
+            subprocess.check_output(f"/sbin/disklabel -A {vnd}".split(), stderr=subprocess.STDOUT, encoding="utf-8")
+            .split()[1][:-1]
+            .strip()
         )
         logging.debug(f"block device {self.dev} created")
         return self.dev
@@ -791,9 +1252,7 @@ class OpenBSD:
         if self.fs_type in ["ufs", "4.3bsd"]:
             flag = "ffs"
         if not GenericFilesystemCreator.generic_mount(flag, self.dev, self.mount_pt):
-            self._unmk_blk_dev()
-            logging.error(f"Failed to mount {self.fs_name} during populating phase")
-            sys.exit(1)
+            raise GeneratorError(f"Failed to mount {self.fs_name} during populating phase")
 
     def unmount_fs(self):
         self._unmount_ext_ufs()
@@ -812,7 +1271,7 @@ class OpenBSD:
 #######################################################################################################################
 
 
-class NetBSD:
+class NetBSD(GenericFilesystemCreator):
     def __init__(self, fs, size, name, location, mount_pt, n_files, max_fsize, mode, save_pt):
         super(NetBSD, self).__init__()
         self.fs_type = fs
@@ -827,10 +1286,9 @@ class NetBSD:
         self.save_pt = save_pt
 
     def _mk_blk_dev(self):
-        _ = subprocess.check_output(f"/usr/sbin/vndconfig vnd0 {self.path}".split(), encoding="utf-8").strip()
-        self.dev = "/dev/vnd0"
-        subprocess.call(f"/sbin/disklabel {self.dev}".split(), stdout=subprocess.DEVNULL)
-        self.dev = "/dev/rvnd0"
+        vnd = _attach_vnd("/usr/sbin/vndconfig", self.path)
+        subprocess.call(f"/sbin/disklabel /dev/{vnd}".split(), stdout=subprocess.DEVNULL)
+        self.dev = f"/dev/r{vnd}"
         logging.debug(f"block device {self.dev} created")
         return self.dev
 
@@ -868,9 +1326,7 @@ class NetBSD:
         if self.fs_type in ["ufs", "4.3bsd"]:
             flag = "ufs"
         if not GenericFilesystemCreator.generic_mount(flag, self.dev, self.mount_pt):
-            self._unmk_blk_dev()
-            logging.error(f"Failed to mount {self.fs_name} during populating phase")
-            sys.exit(1)
+            raise GeneratorError(f"Failed to mount {self.fs_name} during populating phase")
 
     def unmount_fs(self):
         self._unmount_ext_ufs()
@@ -889,7 +1345,22 @@ def main():
         print("[!] Script needs to be run as root!")
         sys.exit(1)
     logging.basicConfig(level="ERROR")
-    return GenericFilesystemCreator().mk_file_system()
+    creator = GenericFilesystemCreator()
+    try:
+        res = creator.mk_file_system()
+    except GeneratorError as e:
+        logging.error(e)
+        sys.exit(1)
+    if creator.batch_jobs:
+        if res:
+            sys.exit(1)  # number of failed batch jobs
+        return res
+    # the library stays quiet, only the command line prints the log
+    if not res.log:
+        print(f"Created empty {creator.config.fs_type} disk: {res.path} {res.fs_name}")
+    elif not creator.config.log_path:
+        print(json.dumps(res.log, separators=(",", ":"), indent=4))
+    return res
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import socket
+import sys
+import threading
+import time
+
+PROBE_INTERVAL = 0.25
+PROBE_TIMEOUT = 0.25
+MISS_THRESHOLD = 3
+
+UP = "up"
+HANG = "hang"  # the kernel still completes the TCP handshake, but sshd never gets to send its banner
+DOWN = "down"  # nothing answers at all, e.g. a panicked kernel
+
+
+def probe(host, port=22, timeout=PROBE_TIMEOUT):
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except OSError:
+        return DOWN
+    try:
+        sock.settimeout(timeout)
+        return UP if sock.recv(4).startswith(b"SSH") else HANG
+    except OSError:
+        return HANG
+    finally:
+        sock.close()
+
+
+class LivenessMonitor:
+    # A target only counts as dead after `misses` probes in a row failed, a single lost probe is not a crash
+    def __init__(
+        self,
+        host,
+        port=22,
+        interval=PROBE_INTERVAL,
+        timeout=PROBE_TIMEOUT,
+        misses=MISS_THRESHOLD,
+        on_dead=None,
+        probe_fn=probe,
+    ):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.misses = misses
+        self.on_dead = on_dead
+        self.probe_fn = probe_fn
+        self.state = UP
+        self.verdict = None  # HANG or DOWN once the miss threshold was hit
+        self.last_seen = 0.0
+        self.detected_at = None
+        self._missed = 0
+        self._dead = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _update(self, state):
+        self.state = state
+        if state == UP:
+            self._missed = 0
+            self.last_seen = time.monotonic()
+            return True
+        self._missed += 1
+        if self._missed >= self.misses and not self._dead.is_set():
+            self.verdict = state
+            self.detected_at = time.monotonic()
+            self._dead.set()
+            logging.debug(f"{self.host}:{self.port} is {state} after {self._missed} missed probes")
+            if self.on_dead:
+                self.on_dead(state)
+        return False
+
+    def check(self):
+        # Synchronous verdict, returns early on the first good probe
+        self.reset()
+        while not self._dead.is_set():
+            if self._update(self.probe_fn(self.host, self.port, self.timeout)):
+                return True
+            time.sleep(self.interval)
+        return False
+
+    def reset(self):
+        self._missed = 0
+        self.verdict = self.detected_at = None
+        self._dead.clear()
+
+    def _loop(self):
+        while not self._stop.is_set() and not self._dead.is_set():
+            start = time.monotonic()
+            self._update(self.probe_fn(self.host, self.port, self.timeout))
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def start(self):
+        self.reset()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"liveness-{self.host}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def is_dead(self):
+        return self._dead.is_set()
+
+    def wait_dead(self, timeout=None):
+        return self._dead.wait(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watches a target and reports the moment it stops answering")
+    parser.add_argument("--host", "-rh", type=str, required=True, help="Remote Host")
+    parser.add_argument("--port", "-p", type=int, default=22, help="Remote Port")
+    parser.add_argument("--interval", "-i", type=float, default=PROBE_INTERVAL, help="Default: %(default)ss")
+    parser.add_argument("--misses", "-m", type=int, default=MISS_THRESHOLD, help="Default: %(default)s")
+    args = parser.parse_args()
+
+    mon = LivenessMonitor(args.host, args.port, interval=args.interval, timeout=args.interval, misses=args.misses)
+    print(f"[*] Watching {args.host}:{args.port}")
+    with mon:
+        try:
+            mon.wait_dead()
+        except KeyboardInterrupt:
+            return 0
+    print(f"[!] {args.host} is {mon.verdict}")
+    if mon.last_seen:
+        print(f"[*] Last answer {mon.detected_at - mon.last_seen:.3f}s before detection")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
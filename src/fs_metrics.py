@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from fs_timeouts import StreamingHistogram
+
+PREFIX = "fsfuzz"
+INTERVAL = 5
+RATE_WINDOW = 60
+LE_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def _atomic_write(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class Metrics:
+    # Counters and latency histograms of a campaign, periodically dumped as json and in the Prometheus text format
+    def __init__(self, json_path=None, prom_path=None, interval=INTERVAL):
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.start = time.time()
+        self.execs = 0
+        self.outcomes = collections.Counter()
+        self.stages = {}
+        self.resets = collections.Counter()
+        self.reset_time = collections.Counter()
+        self.dedup_skips = 0
+        self.edges = 0
+        self.promoted = 0
+        self.corpus = 0
+        self.verdicts = collections.Counter()
+        self.filtered = 0
+        self.cache_hits = 0
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def observe(self, stage, took):
+        with self._lock:
+            self.stages.setdefault(stage, StreamingHistogram()).add(took)
+
+    def outcome(self, outcome):
+        now = time.time()
+        with self._lock:
+            self.execs += 1
+            self.outcomes[outcome] += 1
+            self._recent.append(now)
+
+    def reset(self, target, took):
+        with self._lock:
+            self.resets[target] += 1
+            self.reset_time[target] += took
+
+    def coverage(self, edges, promoted=False, corpus=0):
+        with self._lock:
+            self.edges = edges
+            self.promoted += promoted
+            self.corpus = corpus
+
+    def prefilter(self, verdict, dropped=False):
+        with self._lock:
+            self.verdicts[verdict] += 1
+            self.filtered += dropped
+
+    def cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def skip(self):
+        with self._lock:
+            self.dedup_skips += 1
+
+    def _rate(self, now):
+        while self._recent and self._recent[0] < now - RATE_WINDOW:
+            self._recent.popleft()
+        return len(self._recent) / min(RATE_WINDOW, max(now - self.start, 1e-9))
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            uptime = now - self.start
+            return {
+                "time": now,
+                "uptime": uptime,
+                "execs": self.execs,
+                "execs_per_sec": self.execs / uptime if uptime else 0.0,
+                f"execs_per_sec_{RATE_WINDOW}s": self._rate(now),
+                "outcomes": dict(self.outcomes),
+                "stages": {
+                    stage: {
+                        "n": h.n,
+                        "mean": h.mean(),
+                        "p50": h.quantile(0.5),
+                        "p90": h.quantile(0.9),
+                        "p99": h.quantile(0.99),
+                        "max": h.max,
+                    }
+                    for stage, h in self.stages.items()
+                },
+                "resets": {t: {"n": n, "seconds": self.reset_time[t]} for t, n in self.resets.items()},
+                "dedup_skips": self.dedup_skips,
+                "edges": self.edges,
+                "promoted": self.promoted,
+                "corpus": self.corpus,
+                "prefilter": dict(self.verdicts),
+                "filtered": self.filtered,
+                "cache_hits": self.cache_hits,
+            }
+
+    def prometheus(self):
+        snap = self.snapshot()
+        out = [
+            f"# HELP {PREFIX}_execs_total Executed test cases",
+            f"# TYPE {PREFIX}_execs_total counter",
+            f"{PREFIX}_execs_total {snap['execs']}",
+            f"# HELP {PREFIX}_execs_per_second Executions per second over the last {RATE_WINDOW}s",
+            f"# TYPE {PREFIX}_execs_per_second gauge",
+            f"{PREFIX}_execs_per_second {snap[f'execs_per_sec_{RATE_WINDOW}s']:.6f}",
+            f"# HELP {PREFIX}_outcomes_total Test cases by outcome",
+            f"# TYPE {PREFIX}_outcomes_total counter",
+        ]
+        out += [f'{PREFIX}_outcomes_total{{outcome="{k}"}} {v}' for k, v in sorted(snap["outcomes"].items())]
+        out += [
+            f"# HELP {PREFIX}_stage_seconds Latency per pipeline stage",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self.stages.items()):
+                out += [f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {h.count_le(le)}' for le in LE_BUCKETS]
+                out.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.n}')
+                out.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {h.total:.6f}')
+                out.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {h.n}')
+        out += [
+            f"# HELP {PREFIX}_vm_resets_total VM resets per target",
+            f"# TYPE {PREFIX}_vm_resets_total counter",
+        ]
+        out += [f'{PREFIX}_vm_resets_total{{target="{t}"}} {r["n"]}' for t, r in sorted(snap["resets"].items())]
+        out += [
+            f"# HELP {PREFIX}_vm_reset_seconds_total Time spent resetting per target",
+            f"# TYPE {PREFIX}_vm_reset_seconds_total counter",
+        ]
+        out += [f'{PREFIX}_vm_reset_seconds_total{{target="{t}"}} {r["seconds"]:.6f}' for t, r in sorted(snap["resets"].items())]
+        out += [
+            f"# HELP {PREFIX}_dedup_skips_total Mutants skipped because an identical one already ran",
+            f"# TYPE {PREFIX}_dedup_skips_total counter",
+            f"{PREFIX}_dedup_skips_total {snap['dedup_skips']}",
+            f"# HELP {PREFIX}_coverage_edges Kernel edges seen so far",
+            f"# TYPE {PREFIX}_coverage_edges gauge",
+            f"{PREFIX}_coverage_edges {snap['edges']}",
+            f"# HELP {PREFIX}_promoted_total Mutants promoted into the corpus for new coverage",
+            f"# TYPE {PREFIX}_promoted_total counter",
+            f"{PREFIX}_promoted_total {snap['promoted']}",
+            f"# HELP {PREFIX}_corpus_seeds Seeds in the corpus",
+            f"# TYPE {PREFIX}_corpus_seeds gauge",
+            f"{PREFIX}_corpus_seeds {snap['corpus']}",
+            f"# HELP {PREFIX}_prefilter_total Pre-filter verdicts",
+            f"# TYPE {PREFIX}_prefilter_total counter",
+        ]
+        out += [f'{PREFIX}_prefilter_total{{verdict="{k}"}} {v}' for k, v in sorted(snap["prefilter"].items())]
+        out += [
+            f"# HELP {PREFIX}_filtered_total Mutants dropped by the pre-filter instead of running them",
+            f"# TYPE {PREFIX}_filtered_total counter",
+            f"{PREFIX}_filtered_total {snap['filtered']}",
+            f"# HELP {PREFIX}_cache_hits_total Mutants answered from the result cache",
+            f"# TYPE {PREFIX}_cache_hits_total counter",
+            f"{PREFIX}_cache_hits_total {snap['cache_hits']}",
+        ]
+        return "\n".join(out) + "\n"
+
+    def write(self):
+        try:
+            if self.json_path:
+                _atomic_write(self.json_path, json.dumps(self.snapshot(), indent=4))
+            if self.prom_path:
+                _atomic_write(self.prom_path, self.prometheus())
+        except OSError as e:
+            logging.warning(f"Writing metrics failed: {e}")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start_writer(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_writer(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.write()
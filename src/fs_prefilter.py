@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Local oracle in front of the vm: mutants the target kernel is certain to refuse at mount time do not have to
+# cost a vm exec. Checks the primary superblock with the field layouts of the superblock parsers and runs the
+# host's fsck (read-only) where one is installed.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from ctypes import sizeof
+
+from fs_util import EXT_SB, SBLOCK_EXT2, SBLOCK_PIGGY, SBLOCK_UFS1, SBLOCK_UFS2, SBLOCKSIZE, UFS_SB, get_int
+
+CLEAN = "clean"
+INCONSISTENT = "inconsistent"  # mounts as far as we can tell, but fsck finds damage: the interesting ones
+REJECTED = "rejected"  # the kernel refuses it before touching anything beyond the superblock
+UNKNOWN = "unknown"
+VERDICTS = [CLEAN, INCONSISTENT, REJECTED, UNKNOWN]
+# off: no pre-filter, record: check but run everything, drop: never run rejected mutants,
+# weight: run only KEEP_SHARE of the rejected ones, in case the oracle is wrong about some of them
+POLICIES = ["off", "record", "drop", "weight"]
+KEEP_SHARE = 0.1
+CHECK_TIMEOUT = 30
+EXT_MAGIC_NUM = 0xEF53
+UFS_MAGIC_NUMS = [0x19540119, 0x011954]  # UFS2, UFS1
+# sys/ufs/ffs/fs.h, the kernel only looks at these superblock locations
+UFS_SBLOCKSEARCH = [SBLOCK_UFS2, SBLOCK_UFS1, 0, SBLOCK_PIGGY]
+MINBSIZE = 4096
+FSCK_NOISE = ("e2fsck ", "Pass ", "** ")
+MAXBSIZE = 65536
+
+
+def _fields(raw, layout, names):
+    # Offsets come from the ctypes layouts of the superblock parsers
+    res, off = {}, 0
+    for name, ctype in layout:
+        if name in names:
+            res[name] = get_int(raw[off : off + sizeof(ctype)])
+        off += sizeof(ctype)
+    return res
+
+
+def _pow2(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+def detect(f):
+    f.seek(SBLOCK_EXT2)
+    ext = _fields(f.read(SBLOCKSIZE), EXT_SB, ["e2fs_magic"])
+    if ext.get("e2fs_magic") == EXT_MAGIC_NUM:
+        return "ext"
+    for loc in UFS_SBLOCKSEARCH:
+        f.seek(loc)
+        if _fields(f.read(SBLOCKSIZE), UFS_SB, ["fs_magic"]).get("fs_magic") in UFS_MAGIC_NUMS:
+            return "ufs"
+    return None
+
+
+def check_ext_sb(f):
+    # subset of the checks in ext2_compute_sb_data() and ext2_check_sb_compat() of FreeBSD's ext2fs
+    f.seek(SBLOCK_EXT2)
+    names = ["e2fs_magic", "e2fs_rev", "e2fs_log_bsize", "e2fs_bpg", "e2fs_ipg", "e2fs_bcount", "e2fs_first_dblock"]
+    sb = _fields(f.read(SBLOCKSIZE), EXT_SB, names + ["e2fs_inode_size"])
+    if sb["e2fs_magic"] != EXT_MAGIC_NUM:
+        return "bad magic"
+    if sb["e2fs_rev"] > 1:
+        return f"revision {sb['e2fs_rev']}"
+    if sb["e2fs_log_bsize"] > 6:
+        return f"block size 1024 << {sb['e2fs_log_bsize']}"
+    if not sb["e2fs_bpg"] or not sb["e2fs_ipg"]:
+        return "empty block groups"
+    if sb["e2fs_first_dblock"] >= sb["e2fs_bcount"]:
+        return "first data block beyond the end"
+    if sb["e2fs_rev"] == 1:
+        isize = sb["e2fs_inode_size"]
+        if isize < 128 or isize > 1024 << sb["e2fs_log_bsize"] or not _pow2(isize):
+            return f"inode size {isize}"
+    return None
+
+
+def check_ufs_sb(f):
+    # ffs_sbget() takes the first location with a sane superblock
+    reasons = []
+    for loc in UFS_SBLOCKSEARCH:
+        f.seek(loc)
+        sb = _fields(f.read(SBLOCKSIZE), UFS_SB, ["fs_magic", "fs_bsize", "fs_sbsize"])
+        if sb.get("fs_magic") not in UFS_MAGIC_NUMS:
+            continue
+        if not MINBSIZE <= sb["fs_bsize"] <= MAXBSIZE or not _pow2(sb["fs_bsize"]):
+            reasons.append(f"block size {sb['fs_bsize']} at {loc}")
+        elif sb["fs_sbsize"] > SBLOCKSIZE:
+            reasons.append(f"superblock size {sb['fs_sbsize']} at {loc}")
+        else:
+            return None
+    return "; ".join(reasons) or "no superblock"
+
+
+def _fsck_cmd(fs):
+    if fs == "ext":
+        tool = shutil.which("e2fsck")
+        return [tool, "-n", "-f"] if tool else None
+    tool = shutil.which("fsck_ufs") or shutil.which("fsck.ufs")
+    return [tool, "-n"] if tool else None
+
+
+def run_fsck(path, fs, timeout=CHECK_TIMEOUT):
+    cmd = _fsck_cmd(fs)
+    if not cmd:
+        return None
+    try:
+        p = subprocess.run(cmd + [path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"checker": os.path.basename(cmd[0]), "verdict": INCONSISTENT, "reason": "fsck timeout"}
+    # first finding, skipping the banner and the pass headers of e2fsck and fsck_ufs
+    out = [l for l in p.stdout.decode(errors="replace").splitlines() if l.strip() and not l.startswith(FSCK_NOISE)]
+    # e2fsck: 0 clean, 1/2/4 errors (-n leaves them uncorrected), 8 could not even open the file system
+    if p.returncode == 0:
+        verdict = CLEAN
+    elif fs == "ext" and p.returncode & 8:
+        verdict = REJECTED
+    else:
+        verdict = INCONSISTENT
+    return {"checker": os.path.basename(cmd[0]), "verdict": verdict, "reason": out[0] if out and verdict != CLEAN else ""}
+
+
+def detect_path(path):
+    with open(path, "rb") as f:
+        return detect(f)
+
+
+def check_image(path, fs_type=None, fsck=True, timeout=CHECK_TIMEOUT):
+    # Runs in a worker process, only returns plain data. Pass the type of the seed, a mutant with a broken magic
+    # would not be detected at all
+    try:
+        with open(path, "rb") as f:
+            fs = fs_type or detect(f)
+            if fs not in ["ext", "ufs"]:
+                return {"verdict": UNKNOWN, "checker": "parser", "reason": "unknown file system"}
+            reason = check_ext_sb(f) if fs == "ext" else check_ufs_sb(f)
+    except OSError as e:
+        return {"verdict": UNKNOWN, "checker": "parser", "reason": str(e)}
+    if reason:
+        return {"verdict": REJECTED, "checker": "parser", "reason": reason, "fs": fs}
+    res = run_fsck(path, fs, timeout) if fsck else None
+    if res is None:
+        return {"verdict": UNKNOWN, "checker": "parser", "reason": "", "fs": fs}
+    res["fs"] = fs
+    return res
+
+
+class PreFilter:
+    def __init__(self, policy="drop", workers=None, keep_share=KEEP_SHARE, fsck=True, timeout=CHECK_TIMEOUT):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown pre-filter policy {policy}")
+        self.policy = policy
+        self.keep_share = keep_share
+        self.fsck = fsck
+        self.timeout = timeout
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers) if policy != "off" else None
+
+    def submit(self, path, fs_type=None):
+        return self.pool.submit(check_image, path, fs_type, self.fsck, self.timeout)
+
+    def keep(self, verdict, u):
+        # whether a mutant with this verdict still goes to the vm, u is uniform in [0, 1)
+        if verdict != REJECTED or self.policy == "record":
+            return True
+        return self.policy == "weight" and u < self.keep_share
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _collect(paths):
+    for p in paths:
+        if os.path.isdir(p):
+            yield from (os.path.join(p, f) for f in sorted(os.listdir(p)))
+        else:
+            yield p
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify test cases locally before they go to a target")
+    parser.add_argument("paths", nargs="+", help="Images or directories of images")
+    parser.add_argument("--file_type", "-ft", choices=["ext", "ufs"], help="Skip the detection")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="Worker processes. Default: cpu count")
+    parser.add_argument("--no_fsck", action="store_true", help="Only run the superblock checks")
+    parser.add_argument("--timeout", "-t", type=float, default=CHECK_TIMEOUT, help="fsck timeout. Default: %(default)ss")
+    args = parser.parse_args()
+
+    pf = PreFilter("record", workers=args.workers, fsck=not args.no_fsck, timeout=args.timeout)
+    paths = list(_collect(args.paths))
+    counts = dict.fromkeys(VERDICTS, 0)
+    for path, fut in [(p, pf.submit(p, args.file_type)) for p in paths]:
+        res = fut.result()
+        counts[res["verdict"]] += 1
+        print(f"[*] {path}: {res['verdict']} ({res['checker']}{': ' + res['reason'] if res['reason'] else ''})")
+    pf.shutdown()
+    print(f"[+] {len(paths)} images, " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# Persistent cache of execution results, keyed by (kernel build, image digest, workload). Lets a campaign skip
+# test cases some earlier campaign already ran on the same kernel.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+MAX_ENTRIES = 100000
+COMMIT_EVERY = 64
+# never served from the cache, says more about the target than about the test case
+UNCACHED = ["error", "filtered"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    kernel TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    result TEXT,
+    created REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE INDEX IF NOT EXISTS results_kernel ON results (kernel);
+CREATE TABLE IF NOT EXISTS kernels (
+    kernel TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    retired REAL
+);
+"""
+
+
+def kernel_id(build):
+    # the agent reports `uname -rv`, which names the exact build, hash it into something short
+    return hashlib.sha256(build.encode()).hexdigest()[:16]
+
+
+def cache_key(kernel, digest, workload):
+    return f"{kernel}:{digest.hex() if isinstance(digest, bytes) else digest}:{workload}"
+
+
+class ResultCache:
+    # sqlite is the on disk store, the LRU order is the `used` column. Writes and LRU touches are committed in
+    # batches of COMMIT_EVERY. With a ttl, the results of a kernel build expire ttl seconds after a new build showed up
+    def __init__(self, path, max_entries=MAX_ENTRIES, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.active = set()
+        self.hits = self.misses = 0
+        self._dirty = 0
+        self.n = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.purge()
+        if self.n > max_entries:
+            self.evict(self.n - max_entries)
+            self.commit()
+
+    def _write(self):
+        self._dirty += 1
+        if self._dirty >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._dirty = 0
+
+    def use_kernel(self, kernel):
+        # A build never seen before retires every build no target of this campaign runs
+        if kernel in self.active:
+            return
+        self.active.add(kernel)
+        now = time.time()
+        new = self.db.execute("INSERT OR IGNORE INTO kernels (kernel, first_seen) VALUES (?, ?)", (kernel, now)).rowcount
+        self.db.execute("UPDATE kernels SET retired = NULL WHERE kernel = ?", (kernel,))
+        if new:
+            active = list(self.active)
+            self.db.execute(
+                f"UPDATE kernels SET retired = ? WHERE retired IS NULL AND kernel NOT IN ({','.join('?' * len(active))})",
+                [now] + active,
+            )
+        self.commit()
+        self.purge()
+
+    def purge(self):
+        # drops the results of kernel builds retired longer than ttl ago
+        if self.ttl is None:
+            return 0
+        cur = self.db.execute(
+            "DELETE FROM results WHERE kernel IN (SELECT kernel FROM kernels WHERE retired IS NOT NULL AND retired < ?)",
+            (time.time() - self.ttl,),
+        )
+        self.n -= cur.rowcount
+        self.commit()
+        return cur.rowcount
+
+    def get(self, key):
+        row = self.db.execute("SELECT outcome, result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        self._write()
+        return {"outcome": row[0], "result": json.loads(row[1]) if row[1] else None}
+
+    def put(self, key, kernel, outcome, result=None):
+        if outcome in UNCACHED:
+            return
+        now = time.time()
+        known = self.db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO results (key, kernel, outcome, result, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kernel, outcome, json.dumps(result, separators=(",", ":")) if result else None, now, now),
+        )
+        self.n += not known
+        if self.n > self.max_entries:
+            self.evict(self.n - self.max_entries)
+        self._write()
+
+    def evict(self, n):
+        cur = self.db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (n,))
+        self.n -= cur.rowcount
+        return cur.rowcount
+
+    def stats(self):
+        per_kernel = self.db.execute(
+            "SELECT r.kernel, COUNT(*), k.retired FROM results r LEFT JOIN kernels k ON k.kernel = r.kernel GROUP BY r.kernel"
+        ).fetchall()
+        outcomes = dict(self.db.execute("SELECT outcome, COUNT(*) FROM results GROUP BY outcome").fetchall())
+        return {
+            "entries": self.n,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "outcomes": outcomes,
+            "kernels": {k: {"entries": n, "retired": r} for k, n, r in per_kernel},
+        }
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or trim a persistent result cache")
+    parser.add_argument("cache", type=str, help="sqlite file, e.g. results.db")
+    parser.add_argument("action", choices=["stats", "purge", "clear"])
+    parser.add_argument("--max_entries", "-m", type=int, default=MAX_ENTRIES, help="Default: %(default)s")
+    parser.add_argument("--ttl", "-t", type=float, default=None, help="Drop results of kernels retired this long ago")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cache):
+        print(f"[!] {args.cache} does not exist")
+        return 1
+    cache = ResultCache(args.cache, max_entries=args.max_entries, ttl=args.ttl)
+    if args.action == "purge":
+        print(f"[+] Dropped {cache.purge()} results")
+    elif args.action == "clear":
+        cache.db.execute("DELETE FROM results")
+        cache.n = 0
+        print("[+] Cleared")
+    else:
+        print(json.dumps(cache.stats(), indent=4))
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
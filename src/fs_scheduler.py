@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from fs_connection import drop_connection
+from fs_fuzzer import Fuzzer
+from fs_liveness import UP, probe
+from fs_timeouts import get_tracker
+from fs_vmctl import VirshControl
+
+PROBE_INTERVAL = 0.5
+RECOVER_TIMEOUT = 120
+MAX_ATTEMPTS = 3
+
+
+class ExecError(Exception):
+    pass
+
+
+@dataclass
+class TestCase:
+    path: str
+    user_sim: bool = False
+    base: Optional[str] = None  # seed the mutant was derived from, enables delta uploads
+    attempts: int = 0
+    deaths: List[str] = field(default_factory=list)  # targets that died while running this test case
+
+
+@dataclass
+class Target:
+    name: str
+    host: str
+    port: int = 22
+    user: str = "root"
+    password: str = "root"
+    mount_at: str = "/mnt/HITB/"
+    rfile: str = "/root/tc"
+    compress: Optional[str] = None  # codec for sparse packed full uploads, e.g. "zlib"
+    level: int = 6
+    domain: Optional[str] = None  # libvirt domain, enables the snapshot reset
+    snapshot: Optional[str] = None
+    state: str = "idle"  # idle, busy, quarantined
+    execs: int = 0
+    deaths: int = 0
+    resets: int = 0
+    reset_time: float = 0.0
+    exec_time: float = 0.0
+    last_seen: float = 0.0
+
+    def health(self):
+        return {
+            "state": self.state,
+            "execs": self.execs,
+            "deaths": self.deaths,
+            "resets": self.resets,
+            "avg_reset": self.reset_time / self.resets if self.resets else 0.0,
+            "avg_exec": self.exec_time / self.execs if self.execs else 0.0,
+            "last_seen": self.last_seen,
+        }
+
+
+def load_targets(path):
+    cfg = json.loads(pathlib.Path(path).read_text())
+    return [Target(**t) for t in cfg["targets"]]
+
+
+def is_reachable(host, port, timeout=PROBE_INTERVAL):
+    return probe(host, port, timeout) == UP
+
+
+def reset_target(target: Target):
+    took = VirshControl(target.domain, snapshot=target.snapshot, host=target.host, port=target.port).recover()
+    drop_connection(target.host, target.port, target.user)
+    return took
+
+
+def is_hang(res):
+    return isinstance(res, dict) and any(s["rc"] is None for s in res.get("steps", []))
+
+
+def run_on_target(target: Target, tc: TestCase):
+    fuzzer = Fuzzer(
+        host=target.host,
+        port=target.port,
+        fn=[tc.path, target.rfile],
+        ft=None,
+        mntpt=target.mount_at,
+        user_sim=tc.user_sim,
+        agent=True,
+        base=tc.base,
+        compress=target.compress,
+        level=target.level,
+    )
+    fuzzer.vm_user = target.user
+    fuzzer.vm_password = target.password
+    res = fuzzer.fuzz()
+    if res is None and fuzzer.last_outcome == "error":
+        # no result, but the target is alive: a dropped transport or garbled agent output, not a crash
+        raise ExecError(f"no result from {target.name}")
+    return res
+
+
+class Scheduler:
+    # One worker per target pulls from the shared queue, so a test case always goes to whichever target is free.
+    # A target that dies is quarantined until it answers again, its in-flight test case goes back into the queue.
+    def __init__(
+        self,
+        targets: List[Target],
+        execute: Callable = run_on_target,
+        reset: Optional[Callable] = None,
+        on_result: Optional[Callable] = None,
+        max_attempts=MAX_ATTEMPTS,
+        recover_timeout=RECOVER_TIMEOUT,
+    ):
+        self.targets = targets
+        self.execute = execute
+        self.reset = reset
+        self.on_result = on_result
+        self.max_attempts = max_attempts
+        self.recover_timeout = recover_timeout
+        self.queue = None
+        self.results = []
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(targets)))
+
+    async def _blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def _report(self, tc: TestCase, target: Target, outcome: str, res):
+        self.results.append((tc, target.name, outcome, res))
+        if self.on_result:
+            self.on_result(tc, target, outcome, res)
+
+    async def _recover(self, target: Target):
+        target.state = "quarantined"
+        while True:
+            if self.reset:
+                target.resets += 1
+                start = time.monotonic()
+                try:
+                    await self._blocking(self.reset, target)
+                except Exception as e:
+                    logging.warning(f"Resetting {target.name} failed: {e}")
+                target.reset_time += time.monotonic() - start
+            deadline = time.monotonic() + self.recover_timeout
+            while time.monotonic() < deadline:
+                if await self._blocking(is_reachable, target.host, target.port):
+                    target.state = "idle"
+                    target.last_seen = time.time()
+                    logging.info(f"{target.name} is back")
+                    return
+                await asyncio.sleep(PROBE_INTERVAL)
+            logging.warning(f"{target.name} did not come back within {self.recover_timeout}s")
+
+    async def _worker(self, target: Target):
+        while True:
+            tc = await self.queue.get()
+            try:
+                target.state = "busy"
+                tc.attempts += 1
+                start = time.monotonic()
+                try:
+                    res = await self._blocking(self.execute, target, tc)
+                except ExecError as e:
+                    logging.debug(f"{target.name} failed on {tc.path}: {e}")
+                    target.exec_time += time.monotonic() - start
+                    target.execs += 1
+                    target.state = "idle"
+                    if tc.attempts < self.max_attempts:
+                        self.queue.put_nowait(tc)
+                    else:
+                        self._report(tc, target, "error", None)
+                    continue
+                except Exception as e:
+                    logging.debug(f"{target.name} failed on {tc.path}: {e!r}")
+                    res = None
+                target.exec_time += time.monotonic() - start
+                target.execs += 1
+                if res is not None:
+                    target.last_seen = time.time()
+                    if is_hang(res):
+                        # the target survived, but a stuck mount or md device poisons every following test case
+                        self._report(tc, target, "hang", res)
+                        await self._recover(target)
+                    else:
+                        target.state = "idle"
+                        self._report(tc, target, "ok", res)
+                    continue
+                target.deaths += 1
+                tc.deaths.append(target.name)
+                print(f"[!] {target.name} died on {tc.path} (attempt {tc.attempts})")
+                if tc.attempts < self.max_attempts:
+                    self.queue.put_nowait(tc)
+                else:
+                    self._report(tc, target, "crash", None)
+                await self._recover(target)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, testcases: List[TestCase]):
+        self.queue = asyncio.Queue()
+        for tc in testcases:
+            self.queue.put_nowait(tc)
+        workers = [asyncio.create_task(self._worker(t)) for t in self.targets]
+        try:
+            await self.queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.results
+
+    def health(self):
+        return {t.name: t.health() for t in self.targets}
+
+
+def _collect_testcases(paths, user_sim=False, base=None):
+    tcs = []
+    for p in paths:
+        if os.path.isdir(p):
+            tcs += [TestCase(os.path.join(p, f), user_sim, base) for f in sorted(os.listdir(p))]
+        else:
+            tcs.append(TestCase(p, user_sim, base))
+    return tcs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributes test cases over a pool of target vms")
+    parser.add_argument("--config", "-c", required=True, type=str, help="JSON file with a 'targets' list")
+    parser.add_argument("--testcases", "-t", required=True, nargs="+", help="Test case files or directories")
+    parser.add_argument("--user_interaction", "-ui", action="store_true", help="Run the user interaction after mounting")
+    parser.add_argument("--base", "-b", type=str, help="Seed all test cases were mutated from, enables delta uploads")
+    parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS, help="Default: %(default)s")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO")
+    targets = load_targets(args.config)
+    reset = reset_target if all(t.domain for t in targets) else None
+    sched = Scheduler(targets, reset=reset, max_attempts=args.max_attempts)
+    start = time.monotonic()
+    results = asyncio.run(sched.run(_collect_testcases(args.testcases, args.user_interaction, args.base)))
+    took = time.monotonic() - start
+    crashes = [r for r in results if r[2] == "crash"]
+    hangs = sum(r[2] == "hang" for r in results)
+    errors = sum(r[2] == "error" for r in results)
+    print(
+        f"[+] {len(results)} test cases in {took:.1f}s ({len(results) / took:.2f} execs/s), "
+        f"{len(crashes)} crashes, {hangs} hangs, {errors} errors"
+    )
+    for tc, _, _, _ in crashes:
+        print(f"    {tc.path}: died on {', '.join(tc.deaths)}")
+    print(json.dumps(sched.health(), indent=4))
+    for t in targets:
+        logging.info(f"{t.name} timeouts: {json.dumps(get_tracker(t.host).stats())}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
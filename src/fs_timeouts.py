@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import math
+import os
+import threading
+
+GROWTH = 1.05  # bucket width, quantiles are off by at most 5 %
+MIN_VALUE = 1e-4
+QUANTILE = 0.99
+FACTOR = 3.0
+FLOOR = 0.5
+CEILING = 60.0
+MIN_SAMPLES = 20
+DEFAULT_TIMEOUT = 3
+DEFAULT_TIMEOUTS = {"mount": 10, "unmount": 10, "agent": 30}
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+class StreamingHistogram:
+    # Log spaced buckets, constant memory no matter how many samples were seen
+    def __init__(self, growth=GROWTH, min_value=MIN_VALUE):
+        self.growth = growth
+        self.min_value = min_value
+        self.counts = {}
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, v):
+        return int(math.log(max(v, self.min_value) / self.min_value, self.growth))
+
+    def add(self, v):
+        b = self._bucket(v)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.n += 1
+        self.total += v
+        self.max = max(self.max, v)
+
+    def quantile(self, q):
+        if not self.n:
+            return None
+        rank = q * self.n
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                # upper edge of the bucket, never underestimates
+                return min(self.min_value * self.growth ** (b + 1), self.max)
+        return self.max
+
+    def count_le(self, v):
+        # samples in buckets that end at or below v, i.e. a lower bound like Prometheus' "le" buckets
+        edge = self._bucket(v)
+        return sum(c for b, c in self.counts.items() if b < edge)
+
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    def to_dict(self):
+        return {"counts": {str(k): v for k, v in self.counts.items()}, "n": self.n, "total": self.total, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d, growth=GROWTH, min_value=MIN_VALUE):
+        h = cls(growth, min_value)
+        h.counts = {int(k): v for k, v in d["counts"].items()}
+        h.n, h.total, h.max = d["n"], d["total"], d["max"]
+        return h
+
+
+class TimeoutTracker:
+    # timeout = p99 * factor clamped to [floor, ceiling], the defaults are used until enough samples were seen
+    def __init__(
+        self,
+        factor=FACTOR,
+        floor=FLOOR,
+        ceiling=CEILING,
+        quantile=QUANTILE,
+        min_samples=MIN_SAMPLES,
+        defaults=None,
+        path=None,
+    ):
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.defaults = dict(DEFAULT_TIMEOUTS, **(defaults or {}))
+        self.path = path
+        self.hists = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.load(path)
+
+    def _count(self, op, outcome):
+        self.outcomes.setdefault(op, {"ok": 0, "slow": 0, "hang": 0})[outcome] += 1
+
+    def timeout(self, op):
+        with self._lock:
+            h = self.hists.get(op)
+            if h is None or h.n < self.min_samples:
+                return self.defaults.get(op, DEFAULT_TIMEOUT)
+            return min(max(h.quantile(self.quantile) * self.factor, self.floor), self.ceiling)
+
+    def record(self, op, took):
+        # A success beyond the current p99 is still a success, but worth telling apart from the bulk
+        with self._lock:
+            h = self.hists.setdefault(op, StreamingHistogram())
+            slow = h.n >= self.min_samples and took > h.quantile(self.quantile)
+            h.add(took)
+            outcome = "slow" if slow else "ok"
+            self._count(op, outcome)
+        return outcome
+
+    def hang(self, op, took):
+        # Not added to the histogram, otherwise every hang would push the timeout up towards the ceiling
+        with self._lock:
+            self._count(op, "hang")
+        logging.warning(f"{op} hang after {took:.3f}s")
+        return "hang"
+
+    def stats(self):
+        with self._lock:
+            ops = {}
+            for op, h in self.hists.items():
+                ops[op] = {
+                    "n": h.n,
+                    "mean": h.mean(),
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(self.quantile),
+                    "max": h.max,
+                }
+            for op, counts in self.outcomes.items():
+                ops.setdefault(op, {}).update(counts)
+        for op in ops:
+            ops[op]["timeout"] = self.timeout(op)
+        return ops
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            state = {"hists": {op: h.to_dict() for op, h in self.hists.items()}, "outcomes": self.outcomes}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        with open(path) as f:
+            state = json.load(f)
+        with self._lock:
+            self.hists = {op: StreamingHistogram.from_dict(d) for op, d in state["hists"].items()}
+            self.outcomes = state.get("outcomes", {})
+
+
+def get_tracker(key, **kwargs):
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = TimeoutTracker(**kwargs)
+        return _trackers[key]
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import hashlib
+import lzma
+import os
+import struct
+import zlib
+
+PATCH_MAGIC = b"FSP1"
+PATCH_HDR = "<QI"  # final image size, number of patches
+PATCH_ENTRY = "<QI"  # offset, length
+COARSE_BLOCK = 1 << 20
+FINE_BLOCK = 4096
+MERGE_GAP = 16  # patches closer than this are merged, the extra header would cost more than the bytes in between
+
+PACK_MAGIC = b"FSZ1"
+PACK_HDR = "<BQ"  # codec, image size
+PACK_EXTENT = "<QII"  # offset, raw length, compressed length
+PACK_BLOCK = 64 << 10  # all zero blocks of this size are treated as holes
+MAX_EXTENT = 4 << 20
+CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+
+_digests = {}
+
+
+def file_digest(path):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _digests:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(COARSE_BLOCK), b""):
+                h.update(chunk)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def _narrow(base, new, start, end):
+    while start < end and base[start] == new[start]:
+        start += 1
+    while end > start and base[end - 1] == new[end - 1]:
+        end -= 1
+    return start, end
+
+
+def diff_ranges(base: bytes, new: bytes):
+    # Coarse 1 MB compare first, only differing megabytes are looked at in 4 KB blocks and then byte wise
+    common = min(len(base), len(new))
+    ranges = []
+    for coarse in range(0, common, COARSE_BLOCK):
+        coarse_end = min(coarse + COARSE_BLOCK, common)
+        if base[coarse:coarse_end] == new[coarse:coarse_end]:
+            continue
+        for off in range(coarse, coarse_end, FINE_BLOCK):
+            end = min(off + FINE_BLOCK, coarse_end)
+            if base[off:end] == new[off:end]:
+                continue
+            s, e = _narrow(base, new, off, end)
+            if ranges and s - (ranges[-1][0] + ranges[-1][1]) <= MERGE_GAP:
+                ranges[-1][1] = e - ranges[-1][0]
+            else:
+                ranges.append([s, e - s])
+    if len(new) > common:
+        ranges.append([common, len(new) - common])
+    return [(off, new[off : off + n]) for off, n in ranges]
+
+
+def encode_patch(base_digest: str, size: int, patches):
+    out = [PATCH_MAGIC, bytes.fromhex(base_digest), struct.pack(PATCH_HDR, size, len(patches))]
+    for off, data in patches:
+        out.append(struct.pack(PATCH_ENTRY, off, len(data)))
+        out.append(data)
+    return b"".join(out)
+
+
+def mk_patch(base_path, mutant_path):
+    with open(base_path, "rb") as f:
+        base = f.read()
+    with open(mutant_path, "rb") as f:
+        new = f.read()
+    return encode_patch(file_digest(base_path), len(new), diff_ranges(base, new))
+
+
+def apply_patch(patch: bytes, base_path, out_path):
+    # Mirrors the agent side, handy to verify a patch locally
+    assert patch[:4] == PATCH_MAGIC
+    size, n = struct.unpack_from(PATCH_HDR, patch, 36)
+    pos = 36 + struct.calcsize(PATCH_HDR)
+    with open(base_path, "rb") as f:
+        data = bytearray(f.read())
+    del data[size:]
+    for _ in range(n):
+        off, ln = struct.unpack_from(PATCH_ENTRY, patch, pos)
+        pos += struct.calcsize(PATCH_ENTRY)
+        data[off : off + ln] = patch[pos : pos + ln]
+        pos += ln
+    with open(out_path, "wb") as f:
+        f.write(data)
+
+
+def _compress(data, codec, level):
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "lzma":
+        return lzma.compress(data, preset=level)
+    return data
+
+
+def _data_regions(f, size):
+    # Asks the file system for the allocated regions first, so real holes are never even read
+    if not hasattr(os, "SEEK_DATA"):
+        yield 0, size
+        return
+    fd = f.fileno()
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError:
+            return  # only a hole is left
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end
+        pos = end
+
+
+def data_extents(path):
+    zero = bytes(PACK_BLOCK)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for start, end in _data_regions(f, size):
+            f.seek(start)
+            ext_off, ext = start, []
+            ext_len = 0
+            for off in range(start, end, PACK_BLOCK):
+                block = f.read(min(PACK_BLOCK, end - off))
+                if block == zero[: len(block)] or ext_len >= MAX_EXTENT:
+                    if ext:
+                        yield ext_off, b"".join(ext)
+                    ext, ext_len = [], 0
+                    if block == zero[: len(block)]:
+                        continue
+                if not ext:
+                    ext_off = off
+                ext.append(block)
+                ext_len += len(block)
+            if ext:
+                yield ext_off, b"".join(ext)
+
+
+def pack_sparse(path, codec="zlib", level=6):
+    out = [PACK_MAGIC, struct.pack(PACK_HDR, CODECS[codec], os.path.getsize(path))]
+    for off, data in data_extents(path):
+        comp = _compress(data, codec, level)
+        out.append(struct.pack(PACK_EXTENT, off, len(data), len(comp)))
+        out.append(comp)
+    return b"".join(out)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+from abc import ABC, abstractmethod
+
+from fs_liveness import PROBE_INTERVAL, UP, probe
+
+VIRSH_URI = "qemu:///system"
+VIRSH_TIMEOUT = 60
+BOOT_SNAPSHOT = "fuzz_ready"
+BOOT_TIMEOUT = 120
+
+
+class VmControlError(Exception):
+    pass
+
+
+class VmControl(ABC):
+    # Backends implement the primitives, recover() picks the fastest way back to a clean target.
+    # With a host, recover() only returns once sshd answers again and that wait counts into the latency
+    def __init__(self, snapshot=None, host=None, port=22, boot_timeout=BOOT_TIMEOUT):
+        self.snapshot_name = snapshot
+        self.host = host
+        self.port = port
+        self.boot_timeout = boot_timeout
+        self.latencies = []
+
+    @abstractmethod
+    def power_state(self):
+        pass
+
+    @abstractmethod
+    def start(self):
+        pass
+
+    @abstractmethod
+    def stop(self):
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+    @abstractmethod
+    def snapshot(self, name):
+        pass
+
+    @abstractmethod
+    def restore(self, name):
+        pass
+
+    def recover(self):
+        start = time.monotonic()
+        if self.snapshot_name:
+            # A snapshot with memory state resumes an already booted kernel, no boot or sshd start up
+            self.restore(self.snapshot_name)
+        else:
+            state = self.power_state()
+            if state == "running":
+                self.reset()
+            else:
+                if state != "shut off":
+                    # e.g. crashed or paused, only a domain that is shut off can be started
+                    self.stop()
+                self.start()
+        if self.host:
+            self.wait_up()
+        took = time.monotonic() - start
+        self.latencies.append(took)
+        return took
+
+    def wait_up(self):
+        deadline = time.monotonic() + self.boot_timeout
+        while probe(self.host, self.port) != UP:
+            if time.monotonic() > deadline:
+                raise VmControlError(f"{self.host}:{self.port} not up within {self.boot_timeout}s")
+            time.sleep(PROBE_INTERVAL)
+
+    def avg_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+
+class VirshControl(VmControl):
+    def __init__(self, domain, snapshot=None, uri=VIRSH_URI, timeout=VIRSH_TIMEOUT, **kwargs):
+        super().__init__(snapshot, **kwargs)
+        self.domain = domain
+        self.uri = uri
+        self.timeout = timeout
+
+    def _virsh(self, *args):
+        cmd = ["virsh", "-c", self.uri, *args]
+        logging.debug(" ".join(cmd))
+        try:
+            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise VmControlError(f"{' '.join(cmd)}: {e}")
+        out = p.stdout.decode(errors="replace").strip()
+        if p.returncode != 0:
+            raise VmControlError(f"{' '.join(cmd)}: {out}")
+        return out
+
+    def power_state(self):
+        # e.g. "running", "shut off", "paused", "crashed"
+        return self._virsh("domstate", self.domain)
+
+    def start(self):
+        self._virsh("start", self.domain)
+
+    def stop(self):
+        self._virsh("destroy", self.domain)
+
+    def reset(self):
+        self._virsh("reset", self.domain)
+
+    def snapshot(self, name):
+        # Internal snapshots of a running domain include the memory state
+        self._virsh("snapshot-create-as", self.domain, name)
+
+    def restore(self, name):
+        self._virsh("snapshot-revert", self.domain, name, "--running", "--force")
+
+
+class FakeControl(VmControl):
+    # Local stand-in, records every call and optionally simulates the restore time
+    def __init__(self, snapshot=None, delay=0.0, on_restore=None, **kwargs):
+        super().__init__(snapshot, **kwargs)
+        self.state = "running"
+        self.snapshots = {snapshot} if snapshot else set()
+        self.delay = delay
+        self.on_restore = on_restore
+        self.calls = []
+
+    def power_state(self):
+        self.calls.append("power_state")
+        return self.state
+
+    def start(self):
+        self.calls.append("start")
+        time.sleep(self.delay)
+        self.state = "running"
+
+    def stop(self):
+        self.calls.append("stop")
+        self.state = "shut off"
+
+    def reset(self):
+        self.calls.append("reset")
+        time.sleep(self.delay)
+        self.state = "running"
+
+    def snapshot(self, name):
+        self.calls.append(f"snapshot {name}")
+        self.snapshots.add(name)
+
+    def restore(self, name):
+        self.calls.append(f"restore {name}")
+        if name not in self.snapshots:
+            raise VmControlError(f"no snapshot {name}")
+        time.sleep(self.delay)
+        self.state = "running"
+        if self.on_restore:
+            self.on_restore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Controls the target vm through libvirt")
+    parser.add_argument("--domain", "-d", required=True, type=str, help="libvirt domain of the target")
+    parser.add_argument("--uri", "-c", type=str, default=VIRSH_URI, help="Default: %(default)s")
+    parser.add_argument("--snapshot", "-s", type=str, default=BOOT_SNAPSHOT, help="Default: %(default)s")
+    parser.add_argument("--host", "-rh", type=str, default=None, help="Target address, recover waits until sshd answers")
+    parser.add_argument("--port", "-p", type=int, default=22, help="Default: %(default)s")
+    parser.add_argument("--runs", "-n", type=int, default=1, help="Repeat recover this often and print the latency")
+    parser.add_argument("action", choices=["state", "start", "stop", "reset", "snapshot", "restore", "recover"])
+    args = parser.parse_args()
+
+    ctl = VirshControl(args.domain, snapshot=args.snapshot, uri=args.uri, host=args.host, port=args.port)
+    try:
+        if args.action == "state":
+            print(ctl.power_state())
+        elif args.action == "snapshot":
+            # take it once the vm is booted and the agent is installed
+            ctl.snapshot(args.snapshot)
+            print(f"[+] Created snapshot {args.snapshot} of {args.domain}")
+        elif args.action == "restore":
+            ctl.restore(args.snapshot)
+        elif args.action == "recover":
+            for i in range(args.runs):
+                print(f"[+] Run {i + 1}: {ctl.recover():.3f}s")
+            print(f"[+] Average: {ctl.avg_latency():.3f}s")
+        else:
+            getattr(ctl, args.action)()
+    except VmControlError as e:
+        print(f"[!] {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Seeded post-mount workloads. A workload is a list of file system operations that is shipped to the target in
+# one piece and executed there in one go, the per operation results come back in bulk.
+
+import argparse
+import base64
+import json
+import random
+import shlex
+import sys
+import zlib
+
+WORKLOAD_OPS = 200
+MAX_FILES = 32
+MAX_DIRS = 8
+WRITE_SIZES = [512, 1024, 4096, 16384, 65536]
+MAX_BLOCKS = 64
+# op -> weight, keep the names in sync with fs_agent.py
+OPS = {
+    "create": 12,
+    "mkdir": 3,
+    "write": 20,
+    "truncate": 8,
+    "rename": 8,
+    "link": 5,
+    "readdir": 8,
+    "stat": 12,
+    "unlink": 8,
+    "fsync": 6,
+}
+# share of operations on a name that does not exist, exercises the error paths of the file system as well
+MISS_RATE = 0.05
+
+
+class Workload:
+    # Tracks the names the sequence created so far, so most operations hit existing files
+    def __init__(self, seed=0, max_files=MAX_FILES, max_dirs=MAX_DIRS):
+        self.rng = random.Random(seed)
+        self.max_files = max_files
+        self.max_dirs = max_dirs
+        self.files = []
+        self.dirs = [""]
+        self.n = 0
+
+    def _fresh(self, prefix):
+        self.n += 1
+        d = self.rng.choice(self.dirs)
+        return f"{d}/{prefix}{self.n}" if d else f"{prefix}{self.n}"
+
+    def _file(self):
+        if not self.files or self.rng.random() < MISS_RATE:
+            return self._fresh("f")
+        return self.rng.choice(self.files)
+
+    def _dir(self):
+        if self.rng.random() < MISS_RATE:
+            return self._fresh("d")
+        return self.rng.choice(self.dirs)
+
+    def _forget(self, path):
+        if path in self.files:
+            self.files.remove(path)
+
+    def op(self):
+        name = self.rng.choices(list(OPS), weights=list(OPS.values()))[0]
+        if name == "create" and len(self.files) >= self.max_files:
+            name = "unlink"
+        if name == "mkdir" and len(self.dirs) > self.max_dirs:
+            name = "readdir"
+        if name == "create":
+            path = self._fresh("f")
+            self.files.append(path)
+            return ["create", path]
+        if name == "mkdir":
+            path = self._fresh("d")
+            self.dirs.append(path)
+            return ["mkdir", path]
+        if name == "write":
+            size = self.rng.choice(WRITE_SIZES)
+            # offsets are whole blocks of the write size, so the shell variant can seek with dd
+            return ["write", self._file(), self.rng.randrange(MAX_BLOCKS), size, self.rng.randrange(256)]
+        if name == "truncate":
+            return ["truncate", self._file(), self.rng.randrange(MAX_BLOCKS * max(WRITE_SIZES))]
+        if name == "rename":
+            src, dst = self._file(), self._fresh("f")
+            if src in self.files:
+                self._forget(src)
+                self.files.append(dst)
+            return ["rename", src, dst]
+        if name == "link":
+            src, dst = self._file(), self._fresh("f")
+            if src in self.files:
+                self.files.append(dst)
+            return ["link", src, dst]
+        if name == "readdir":
+            return ["readdir", self._dir()]
+        if name == "unlink":
+            path = self._file()
+            self._forget(path)
+            return ["unlink", path]
+        return [name, self._file()]
+
+    def generate(self, n=WORKLOAD_OPS):
+        return [self.op() for _ in range(n)]
+
+
+def generate(seed=0, n=WORKLOAD_OPS):
+    return Workload(seed).generate(n)
+
+
+def encode(ops):
+    # compact enough for a single command line argument, a few hundred ops are a couple of KB
+    return base64.b64encode(zlib.compress(json.dumps(ops, separators=(",", ":")).encode(), 9)).decode()
+
+
+def decode(encoded):
+    return json.loads(zlib.decompress(base64.b64decode(encoded)))
+
+
+def _shell(op):
+    name, args = op[0], [shlex.quote(str(a)) for a in op[1:]]
+    if name == "create":
+        return f": >> {args[0]}"
+    if name == "mkdir":
+        return f"mkdir {args[0]}"
+    if name == "write":
+        block, size, byte = op[2:]
+        # test first, dd would create a missing file where the agent fails with ENOENT
+        return (
+            f"test -f {args[0]} && printf '%{size}s' '' | tr ' ' '\\{byte:03o}' | "
+            f"dd of={args[0]} ibs=512 obs={size} seek={block} conv=notrunc"
+        )
+    if name == "truncate":
+        return f"test -f {args[0]} && truncate -s {args[1]} {args[0]}"
+    if name == "rename":
+        return f"mv {args[0]} {args[1]}"
+    if name == "link":
+        return f"ln {args[0]} {args[1]}"
+    if name == "readdir":
+        return f"ls -fa {args[0] if op[1] else '.'} > /dev/null"
+    if name == "stat":
+        return f"stat {args[0]} > /dev/null"
+    if name == "unlink":
+        return f"rm {args[0]}"
+    if name == "fsync":
+        return f"fsync {args[0]}"
+    raise ValueError(f"Unknown op {name}")
+
+
+def to_script(ops, root):
+    # For targets without the agent: one /bin/sh invocation, one exit status per line
+    lines = [f"cd {shlex.quote(root)} || exit 1"]
+    lines += [f"{_shell(op)} 2> /dev/null; echo $?" for op in ops]
+    return "\n".join(lines) + "\n"
+
+
+def parse_script(out):
+    return [int(line) for line in out.split() if line.isdigit()]
+
+
+def summary(ops, rcs):
+    failed = {}
+    for op, rc in zip(ops, rcs):
+        if rc:
+            failed[op[0]] = failed.get(op[0], 0) + 1
+    return {"ops": len(ops), "done": len(rcs), "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeded file system workloads")
+    parser.add_argument("--seed", "-s", type=int, default=0, help="Workload seed. Default: %(default)s")
+    parser.add_argument("--ops", "-n", type=int, default=WORKLOAD_OPS, help="Number of operations. Default: %(default)s")
+    parser.add_argument("--format", "-f", choices=["json", "encoded", "sh"], default="json")
+    parser.add_argument("--root", "-r", default="/mnt/HITB", help="Mount point for -f sh. Default: %(default)s")
+    args = parser.parse_args()
+
+    ops = generate(args.seed, args.ops)
+    if args.format == "encoded":
+        print(encode(ops))
+    elif args.format == "sh":
+        sys.stdout.write(to_script(ops, args.root))
+    else:
+        print(json.dumps(ops))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sys
+
+from extract_core_features import INDEX_NAME, REPORT_GLOB, bucket_reports, save_index
+
+TOP_FRAMES = 8
+NUM_PERM = 64
+BANDS = 16  # 16 bands of 4 rows, pairs above ~0.5 similarity become candidates
+THRESHOLD = 0.5
+MINHASH_SEED = 0x48495442
+MERSENNE = (1 << 61) - 1
+# frames every panic has, they say nothing about the bug
+GENERIC_FRAMES = {
+    'kdb_backtrace', 'vpanic', 'panic', 'kassert_panic', 'trap', 'trap_fatal', 'trap_pfault', 'calltrap',
+    'db_trace_self', 'db_trace_self_wrapper', 'doadump', 'kern_reboot', 'amd64_syscall', 'fast_syscall_common',
+    'Xfast_syscall',
+}
+FRAME_RE = re.compile(r'^(?:#\d+\s+0x[0-9a-f]+\s+at\s+)?([A-Za-z_.$][\w.$]*)')
+
+
+def normalize_frames(stack, top=TOP_FRAMES):
+    # function names only, offsets and inlined locations differ between builds and compilers
+    frames = []
+    for line in stack:
+        line = line.strip()
+        if not line or line.startswith('---'):
+            continue
+        m = FRAME_RE.match(line)
+        if m and m.group(1) not in GENERIC_FRAMES:
+            frames.append(m.group(1))
+    return frames[:top]
+
+
+def shingles(panic, frames):
+    # single frames and consecutive pairs, so order matters a bit but one differing frame does not change everything
+    res = {f'p:{panic}'}
+    res.update(f'f:{f}' for f in frames)
+    res.update(f'b:{a}>{b}' for a, b in zip(frames, frames[1:]))
+    return res
+
+
+class MinHash:
+    def __init__(self, num_perm=NUM_PERM, seed=MINHASH_SEED):
+        rng = random.Random(seed)
+        self.perms = [(rng.randrange(1, MERSENNE), rng.randrange(MERSENNE)) for _ in range(num_perm)]
+
+    def signature(self, items):
+        xs = [int.from_bytes(hashlib.blake2b(i.encode(), digest_size=8).digest(), 'little') for i in items]
+        return [min((a * x + b) % MERSENNE for x in xs) for a, b in self.perms]
+
+
+def similarity(s1, s2):
+    return sum(a == b for a, b in zip(s1, s2)) / len(s1)
+
+
+class ClusterIndex:
+    # LSH over MinHash signatures: a signature is cut into BANDS bands, clusters sharing a band are the only
+    # candidates a new stack is compared with, so assigning it does not touch every cluster
+    def __init__(self, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS, top=TOP_FRAMES):
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.top = top
+        self.minhash = MinHash(num_perm)
+        self.clusters = {}
+        self.next_id = 0
+        self.tables = [{} for _ in range(bands)]
+
+    def _band_keys(self, sig):
+        return [tuple(sig[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    def _insert(self, cid, sig):
+        for table, key in zip(self.tables, self._band_keys(sig)):
+            table.setdefault(key, set()).add(cid)
+
+    def load(self, clusters):
+        for cid, c in clusters.items():
+            self.clusters[cid] = c
+            self._insert(cid, c['signature'])
+            self.next_id = max(self.next_id, int(cid[1:]) + 1)
+
+    def candidates(self, sig):
+        cands = set()
+        for table, key in zip(self.tables, self._band_keys(sig)):
+            cands |= table.get(key, set())
+        return cands
+
+    def assign(self, bucket, panic, stack):
+        frames = normalize_frames(stack, self.top)
+        sig = self.minhash.signature(shingles(panic, frames))
+        best, best_sim = None, self.threshold
+        for cid in sorted(self.candidates(sig)):
+            sim = similarity(sig, self.clusters[cid]['signature'])
+            if sim >= best_sim:
+                best, best_sim = cid, sim
+        if best is None:
+            # the first stack of a cluster stays its representative
+            best = f'c{self.next_id:05d}'
+            self.next_id += 1
+            self.clusters[best] = {'signature': sig, 'panic': panic, 'frames': frames, 'buckets': []}
+            self._insert(best, sig)
+        if bucket not in self.clusters[best]['buckets']:
+            # e.g. a bucket that was recreated after its reports changed
+            self.clusters[best]['buckets'].append(bucket)
+        return best
+
+
+def cluster_buckets(index, threshold=THRESHOLD, top=TOP_FRAMES):
+    # Assigns the buckets of an extract_core_features index that have no cluster yet
+    ci = ClusterIndex(threshold, top=top)
+    ci.load(index.get('clusters', {}))
+    new = 0
+    for h, b in index['buckets'].items():
+        if b.get('cluster') in ci.clusters:
+            continue
+        b['cluster'] = ci.assign(h, b['panic'], b['stack'])
+        new += 1
+    # buckets can disappear when a report changes
+    for c in ci.clusters.values():
+        c['buckets'] = [h for h in c['buckets'] if h in index['buckets']]
+    index['clusters'] = {cid: c for cid, c in ci.clusters.items() if c['buckets']}
+    return index, new
+
+
+def print_clusters(index):
+    rows = []
+    for cid, c in index['clusters'].items():
+        count = sum(index['buckets'][h]['count'] for h in c['buckets'])
+        rows.append((count, cid, c))
+    for count, cid, c in sorted(rows, key=lambda r: (-r[0], r[1])):
+        print(f'{cid}  {count:6d} reports  {len(c["buckets"]):4d} buckets  {c["panic"]}  {" < ".join(c["frames"][:4])}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster crash buckets by similar stack signatures')
+    parser.add_argument('path', help='Directory of crash reports, bucketed first with extract_core_features')
+    parser.add_argument('--index', '-i', default=None, help=f'Bucket index. Default: <path>/{INDEX_NAME}')
+    parser.add_argument('--glob', '-g', default=REPORT_GLOB, help='File name pattern of reports. Default: %(default)s')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Worker processes. Default: cpu count')
+    parser.add_argument('--threshold', '-t', type=float, default=THRESHOLD, help='Min similarity. Default: %(default)s')
+    parser.add_argument('--frames', '-n', type=int, default=TOP_FRAMES, help='Frames per stack. Default: %(default)s')
+    args = parser.parse_args()
+
+    index_path = args.index or os.path.join(args.path, INDEX_NAME)
+    index, _ = bucket_reports(args.path, index_path, args.glob, args.workers)
+    index, new = cluster_buckets(index, args.threshold, args.frames)
+    save_index(index, index_path)
+    print_clusters(index)
+    print('-' * 80)
+    print(f'{len(index["buckets"])} buckets in {len(index["clusters"])} clusters, {new} newly assigned')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
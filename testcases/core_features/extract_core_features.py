@@ -1,28 +1,102 @@
 #!/usr/bin/env python3
 
+import argparse
+import fnmatch
 import hashlib
+import json
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+INDEX_NAME = 'buckets.json'
+REPORT_GLOB = 'core.txt*'
+CHUNK_SIZE = 16
+
+
+# Only the first panic, the first backtrace and the uptime line after it are of interest. The rest of a core.txt
+# (dmesg, gdb output, ps, vmstat, ...) can be megabytes, the parser stops reading once it has all three.
+PANIC_MARK = 'panic:'
+BT_START = 'KDB: stack backtrace:'
+BT_END = re.compile(r'--- syscall|Uptime')
+TRAP_RE = re.compile(r'---\strap\s')
+FRAME_RE = re.compile(r'#[0-9]{1,3}\s0x[0-9a-f]{0,16}\sat\s')
+UPTIME_RE = re.compile(r'Uptime:\s*(\S+)')
+UPTIME_WINDOW = 16  # lines to look for the uptime after the backtrace ended
+
+
+@dataclass
+class CoreReport:
+    panic: Optional[str] = None  # normalized, e.g. page_fault
+    message: Optional[str] = None  # the whole panic line
+    frames: List[str] = field(default_factory=list)  # cleaned backtrace, one frame per entry
+    uptime: Optional[str] = None
+    lines_read: int = 0
+
+    def clean_stack(self):
+        return ''.join(f + '\n' for f in self.frames)
+
+
+def _panic_name(msg):
+    return msg.split(':')[0].split('(')[0].split('bp')[0].split('fip')[0].split('\t')[0].split(', addr:')[0].strip(
+        ).replace(' ', '_').split('_/')[0]
+
+
+def _clean_frame(line):
+    if FRAME_RE.match(line):
+        return line.split(' at ')[1]
+    return line.split('/frame')[0]
+
+
+def parse_lines(lines):
+    # lines: any iterable of bytes or str lines, e.g. an open file
+    rec = CoreReport()
+    bt, in_bt, bt_done, after_bt = [], False, False, 0
+    for raw in lines:
+        line = (raw.decode(errors='replace') if isinstance(raw, bytes) else raw).rstrip('\r\n')
+        rec.lines_read += 1
+        if rec.message is None and PANIC_MARK in line:
+            rec.message = line.split(PANIC_MARK, 1)[1].strip()
+            rec.panic = _panic_name(line.split(PANIC_MARK, 1)[1])
+        if in_bt:
+            end = BT_END.search(line)
+            bt.append(line[:end.start()] if end else line)
+            if end:
+                in_bt, bt_done = False, True
+        elif not bt_done and BT_START in line:
+            in_bt = True
+            bt.append(line.split(BT_START, 1)[1])
+        if bt_done:
+            m = UPTIME_RE.search(line)
+            if m:
+                rec.uptime = m.group(1)
+            after_bt += 1
+            if rec.message is not None and (rec.uptime or after_bt > UPTIME_WINDOW):
+                break
+    rec.frames = [_clean_frame(l) for l in '\n'.join(bt).strip().split('\n') if not TRAP_RE.match(l)] if bt else []
+    return rec
+
+
+def parse_core(path):
+    with open(path, 'rb') as f:
+        return parse_lines(f)
 
 
 def get_panic_name(data):
-    return str(data).split('panic:')[1].split(':')[0].split('(')[0].split('bp')[0].split('fip')[0].split('\\')[0].split(
-        ', addr:')[0].strip().replace(' ', '_').split('_/')[0]
+    rec = parse_lines(data.splitlines())
+    if rec.panic is None:
+        raise IndexError('no panic')
+    return rec.panic
 
 
 def get_core_details(data):
-    full_strace = str(data).split('KDB: stack backtrace:')[1].split('--- syscall')[0].split('Uptime')[0].replace('\\',
-                                                                                                                 '\n').replace(
-        '\nn', '\n').strip()
-    clean_strace = ''
-    for line in full_strace.split('\n'):
-        if re.match(r'---\strap\s', line):
-            continue
-        if re.match(r'#[0-9]{1,3}\s0x[0-9a-f]{0,16}\sat\s', line):
-            clean_strace += line.split(' at ')[1] + '\n'
-        else:
-            clean_strace += line.split('/frame')[0] + '\n'
-    return clean_strace
+    rec = parse_lines(data.splitlines())
+    if not rec.frames:
+        raise IndexError('no stack backtrace')
+    return rec.clean_stack()
 
 
 def get_sha256_sum(sanitized_stack_trace):
@@ -33,16 +107,110 @@ def get_md5_sum(sanitized_stack_trace):
     return hashlib.md5(sanitized_stack_trace.encode()).hexdigest()
 
 
+def parse_report(path):
+    # Runs in a worker process, returns None for files that are no panic report (e.g. a truncated core.txt)
+    try:
+        rec = parse_core(path)
+    except OSError:
+        return None
+    if rec.panic is None or not rec.frames:
+        return None
+    return {'panic': rec.panic, 'hash': get_sha256_sum(rec.clean_stack()), 'stack': rec.frames, 'uptime': rec.uptime}
+
+
+def find_reports(root, pattern=REPORT_GLOB):
+    for dirpath, _, files in os.walk(root):
+        for fn in sorted(files):
+            if fnmatch.fnmatch(fn, pattern):
+                yield os.path.join(dirpath, fn)
+
+
+def load_index(path):
+    if not os.path.isfile(path):
+        return {'files': {}, 'buckets': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_index(index, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _drop_report(index, rel):
+    old = index['files'].pop(rel, {}).get('hash')
+    b = index['buckets'].get(old)
+    if b and rel in b['reports']:
+        b['reports'].remove(rel)
+        b['count'] -= 1
+
+
+def bucket_reports(root, index_path=None, pattern=REPORT_GLOB, workers=None):
+    # Only files that are new or changed since the last run get parsed, the index remembers size and mtime of the rest
+    index_path = index_path or os.path.join(root, INDEX_NAME)
+    index = load_index(index_path)
+    todo, seen = [], set()
+    for path in find_reports(root, pattern):
+        st = os.stat(path)
+        rel = os.path.relpath(path, root)
+        seen.add(rel)
+        if index['files'].get(rel, {}).get('sig') != [st.st_size, st.st_mtime]:
+            todo.append((rel, path, st))
+    # Deleted and changed reports leave their bucket first. Emptied buckets are only dropped at the end, so a report
+    # that still hashes the same keeps first_seen and cluster of its bucket
+    for rel in [r for r in index['files'] if r not in seen] + [rel for rel, _, _ in todo]:
+        _drop_report(index, rel)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(parse_report, [p for _, p, _ in todo], chunksize=CHUNK_SIZE)
+        for (rel, path, st), res in zip(todo, results):
+            index['files'][rel] = {'sig': [st.st_size, st.st_mtime], 'hash': res['hash'] if res else None}
+            if not res:
+                continue
+            new = {'panic': res['panic'], 'first_seen': st.st_mtime, 'count': 0, 'reports': [], 'stack': res['stack']}
+            b = index['buckets'].setdefault(res['hash'], new)
+            b['first_seen'] = min(b['first_seen'], st.st_mtime)
+            b['count'] += 1
+            b['reports'].append(rel)
+    for h in [h for h, b in index['buckets'].items() if not b['count']]:
+        del index['buckets'][h]
+    save_index(index, index_path)
+    return index, len(todo)
+
+
+def print_buckets(index):
+    buckets = sorted(index['buckets'].items(), key=lambda kv: -kv[1]['count'])
+    for h, b in buckets:
+        first = time.strftime('%Y-%m-%d %H:%M', time.localtime(b['first_seen']))
+        print(f'{b["count"]:6d}  {h[:16]}  {first}  {b["panic"]}')
+
+
 def main():
-    if len(sys.argv) != 2:
-        print(f'Usage: {sys.argv[0]} <core.txt>')
-        sys.exit(-1)
-    with open(sys.argv[1], 'rb') as f:
-        data = f.read()
+    parser = argparse.ArgumentParser(description='Hash the cleaned backtrace of a core.txt or bucket a tree of them')
+    parser.add_argument('path', help='core.txt, or a directory searched recursively for crash reports')
+    parser.add_argument('--index', '-i', default=None, help=f'Bucket index. Default: <path>/{INDEX_NAME}')
+    parser.add_argument('--glob', '-g', default=REPORT_GLOB, help='File name pattern of reports. Default: %(default)s')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='Worker processes. Default: cpu count')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        start = time.time()
+        index, parsed = bucket_reports(args.path, args.index, args.glob, args.workers)
+        print_buckets(index)
+        print('-' * 80)
+        n = sum(b['count'] for b in index['buckets'].values())
+        print(f'{n} reports in {len(index["buckets"])} buckets, parsed {parsed} new in {time.time() - start:.2f}s')
+        return 0
 
-    clean_stack_trace = get_core_details(data)
+    rec = parse_core(args.path)
+    if not rec.frames:
+        print(f'[!] No stack backtrace in {args.path}')
+        return 1
+    clean_stack_trace = rec.clean_stack()
     print(clean_stack_trace)
     print('-' * 80)
+    print(f'Panic:  {rec.panic} (uptime {rec.uptime})')
     print(f'MD5:    {get_md5_sum(clean_stack_trace)}')
     print(f'SHA256: {get_sha256_sum(clean_stack_trace)}')
 